@@ -0,0 +1,511 @@
+import copy
+import json
+import os
+import socketserver
+import threading
+import time
+import http.server
+import urllib.parse
+
+'''
+in memory front door emulator used by the benchmarks
+'''
+FORWARD = '#Microsoft.Azure.FrontDoor.Models.FrontdoorForwardingConfiguration'
+REDIRECT = '#Microsoft.Azure.FrontDoor.Models.FrontdoorRedirectConfiguration'
+KINDS = ['frontendEndpoints', 'backendPools', 'healthProbeSettings', 'loadBalancingSettings', 'routingRules', 'rulesEngines']
+READ_VERBS = ['show', 'list', 'get-access-token']
+
+
+class Failure(Exception):
+    pass
+
+
+class FrontDoorEmulator(object):
+    '''
+    This emulates the az network front-door commands and the front door management api the route manager uses,
+    against front doors held in memory. Front doors are created empty on first use. Every call sleeps for the
+    configured read or write latency outside the state lock, so concurrent calls overlap the way they would
+    against the service, and is counted by command.
+    Like az, a front door sub resource write reads the whole front door, changes its own copy and puts it back
+    without an etag, so two overlapping writes to one front door lose the first one's change. These are counted
+    in lost_updates.
+    '''
+    def __init__(self, read_latency: float = 0, write_latency: float = 0, subscription: str = 'bench', etags: bool = True):
+        self.read_latency = read_latency
+        self.write_latency = write_latency
+        self.subscription = subscription
+        self.etags = etags     # classic front door documents usually carry no etag, False serves them without one
+        self.front_doors = {}
+        self.vaults = {}
+        self.calls = {}
+        self.lost_updates = 0
+        self.on_read = None    # optional callable(fd) run under the lock after a front door document GET, a concurrent edit
+        self._lock = threading.Lock()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = {}
+            self.lost_updates = 0
+
+    def count(self, label: str):
+        with self._lock:
+            self.calls[label] = self.calls.get(label, 0) + 1
+
+    def front_door(self, group: str, name: str):
+        key = (group.lower(), name.lower())
+        if not key in self.front_doors:
+            _id = f'/subscriptions/{self.subscription}/resourceGroups/{group}/providers/Microsoft.Network/frontDoors/{name}'
+            self.front_doors[key] = {
+                'id': _id, 'name': name, 'etag': 1,
+                'frontendEndpoints': [{'id': f'{_id}/frontendEndpoints/{name}-azurefd-net', 'name': f'{name}-azurefd-net',
+                                       'hostName': f'{name}.azurefd.net', 'sessionAffinityEnabledState': 'Disabled',
+                                       'sessionAffinityTtlSeconds': 0, 'customHttpsConfiguration': None,
+                                       'customHttpsProvisioningState': 'Disabled'}],
+                'backendPools': [], 'healthProbeSettings': [], 'loadBalancingSettings': [], 'routingRules': [], 'rulesEngines': []
+            }
+        return self.front_doors[key]
+
+    @classmethod
+    def find(cls, fd: dict, kind: str, name: str):
+        for item in fd[kind]:
+            if item['name'].lower() == str(name).lower():
+                return item
+        return None
+
+    @classmethod
+    def ref(cls, fd: dict, kind: str, name: str):
+        return {'id': f'{fd["id"]}/{kind}/{name}'} if name else None
+
+    @classmethod
+    def put(cls, fd: dict, kind: str, item: dict):
+        ''' replace or append a named sub resource '''
+        item['id'] = f'{fd["id"]}/{kind}/{item["name"]}'
+        existing = cls.find(fd, kind, item['name'])
+        if existing:
+            fd[kind][fd[kind].index(existing)] = item
+        else:
+            fd[kind].append(item)
+        fd['etag'] += 1
+        return item
+
+    @classmethod
+    def wrap(cls, item: dict):
+        item = copy.deepcopy(item)
+        wrapped = {k: item.pop(k) for k in ['id', 'name'] if k in item}
+        wrapped['properties'] = item
+        return wrapped
+
+    @classmethod
+    def unwrap(cls, item: dict):
+        flat = {k: v for k, v in item.items() if k != 'properties'}
+        flat.update(copy.deepcopy(item.get('properties') or {}))
+        return flat
+
+    def arm(self, fd: dict):
+        properties = {k: [self.wrap(x) for x in fd[k]] for k in KINDS}
+        properties['provisioningState'] = 'Succeeded'
+        properties['resourceState'] = 'Enabled'
+        document = {'id': fd['id'], 'name': fd['name'], 'properties': properties}
+        if self.etags:
+            document['etag'] = str(fd['etag'])
+        return document
+
+    # az command emulation
+
+    @classmethod
+    def parse(cls, argv: list):
+        """
+        :return: (command words, {flag: [values]})
+        """
+        aliases = {'-f': '--front-door-name', '-g': '--resource-group', '-n': '--name', '-o': '--output'}
+        words = []
+        flags = {}
+        current = None
+        for arg in argv:
+            if arg.startswith('-') and len(arg) > 1 and not arg[1:].lstrip('-').isdigit():
+                current = aliases.get(arg, arg)
+                flags.setdefault(current, [])
+            elif current:
+                flags[current].append(arg)
+            else:
+                words.append(arg)
+        return words, flags
+
+    @classmethod
+    def output(cls, result, flags: dict):
+        if (flags.get('--output') or [''])[0] == 'none':
+            return ''
+        query = (flags.get('--query') or [None])[0]
+        if query:
+            result = cls.project(result, query)
+        return json.dumps(result) + '\n' if result is not None else ''
+
+    @classmethod
+    def project(cls, result, query: str):
+        """
+        :return: the result of a --query of dotted fields, optionally ending in a {key:path,...} multiselect
+        """
+        path, _, select = query.partition('{')
+        for field in [f for f in path.split('.') if f]:
+            result = result.get(field) if isinstance(result, dict) else None
+        if not select or result is None:
+            return result
+        return {k: cls.project(result, v) for k, v in (pair.split(':', 1) for pair in select.rstrip('}').split(','))}
+
+    def run(self, argv: list):
+        """
+        :return: (exit code, stdout, stderr) for an az argument list, argv[0] is az
+        """
+        words, flags = self.parse(argv[1:])
+        if words == ['rest']:
+            method = (flags.get('--method') or ['get'])[0].lower()
+            label = f'rest {method}'
+            body = (flags.get('--body') or [None])[0]
+            if body and body.startswith('@'):
+                with open(body[1:]) as f:
+                    body = f.read()
+            headers = dict(h.split('=', 1) for h in flags.get('--headers') or [] if '=' in h)
+            self.count(label)
+            time.sleep(self.read_latency if method == 'get' else self.write_latency)
+            status, text = self.rest(method, flags['--url'][0], body, headers)
+            return (0, text, '') if status < 400 else (1, '', f'ERROR: ({status}) {text}')
+
+        label = ' '.join(words)
+        self.count(label)
+        try:
+            if self.read_modify_write(words):
+                result = self.modify(words, flags)
+            else:
+                time.sleep(self.read_latency if words and words[-1] in READ_VERBS else self.write_latency)
+                with self._lock:
+                    result = self.command(words, flags)
+            return 0, self.output(result, flags), ''
+        except Failure as e:
+            return 1, '', f'ERROR: {str(e)}\n'
+
+    @classmethod
+    def read_modify_write(cls, words: list):
+        """
+        :return: True|False if az runs the command as a GET of the whole front door and a PUT of the changed copy,
+        rules engines are their own resources and enable-https is a server side action
+        """
+        return words[:2] == ['network', 'front-door'] and len(words) > 2 and not words[-1] in READ_VERBS \
+            and words[2] != 'rules-engine' and words[2:] != ['frontend-endpoint', 'enable-https']
+
+    def modify(self, words: list, flags: dict):
+        fl = lambda k, d=None: (flags.get(k) or [d])[0]
+        group, name = fl('--resource-group'), fl('--front-door-name') or fl('--name')
+        with self._lock:
+            read = self.front_door(group, name)
+            fd = copy.deepcopy(read)
+        time.sleep(self.read_latency)
+        result = self.command(words, flags, fd)
+        time.sleep(self.write_latency)
+        with self._lock:
+            current = self.front_door(group, name)
+            if current['etag'] != read['etag']:
+                self.lost_updates += 1
+            # the service keeps the rules engines and the https state, they are not written through the front door
+            fd['rulesEngines'] = current['rulesEngines']
+            for fe in fd['frontendEndpoints']:
+                live = self.find(current, 'frontendEndpoints', fe['name'])
+                if live:
+                    fe['customHttpsConfiguration'] = live['customHttpsConfiguration']
+                    fe['customHttpsProvisioningState'] = live['customHttpsProvisioningState']
+            fd['etag'] = current['etag'] + 1
+            self.front_doors[(group.lower(), name.lower())] = fd
+        return result
+
+    def command(self, words: list, flags: dict, fd: dict = None):
+        fl = lambda k, d=None: (flags.get(k) or [d])[0]
+        w = ' '.join(words)
+
+        if w == 'account get-access-token':
+            return {'accessToken': 'bench', 'expires_on': int(time.time()) + 3600, 'subscription': self.subscription}
+        if w == 'account show':
+            return {'tenantId': 'bench-tenant', 'id': self.subscription}
+        if w == 'ad sp show':
+            return {'objectId': 'bench-front-door-sp', 'id': 'bench-front-door-sp'}
+        if w in ['keyvault show', 'keyvault set-policy']:
+            vault = self.vaults.setdefault(fl('--name').lower(), {'name': fl('--name'), 'properties': {'accessPolicies': []}})
+            if w == 'keyvault set-policy':
+                policies = vault['properties']['accessPolicies']
+                policies[:] = [p for p in policies if p['objectId'] != fl('--object-id')]
+                policies.append({'objectId': fl('--object-id'), 'permissions': {
+                    'certificates': flags.get('--certificate-permissions') or [], 'secrets': flags.get('--secret-permissions') or []}})
+            return vault
+        if w.startswith('keyvault') or w.startswith('network dns'):
+            return {}
+
+        if not w.startswith('network front-door'):
+            raise Failure(f'emulator: unsupported command az {w}')
+        fd = fd or self.front_door(fl('--resource-group'), fl('--front-door-name') or fl('--name'))
+        sub = w[len('network front-door '):]
+
+        if sub == 'show':
+            return self.unwrap(self.arm(fd))
+        if sub == 'frontend-endpoint create':
+            if self.find(fd, 'frontendEndpoints', fl('--name')):
+                raise Failure(f'frontend {fl("--name")} already exists')
+            return self.put(fd, 'frontendEndpoints', {
+                'name': fl('--name'), 'hostName': fl('--host-name'),
+                'sessionAffinityEnabledState': 'Enabled' if fl('--session-affinity-enabled') == 'true' else 'Disabled',
+                'sessionAffinityTtlSeconds': int(fl('--session-affinity-ttl', '0')),
+                'webApplicationFirewallPolicyLink': {'id': fl('--waf-policy')} if fl('--waf-policy') else None,
+                'customHttpsConfiguration': None, 'customHttpsProvisioningState': 'Disabled'})
+        if sub == 'frontend-endpoint show':
+            fe = self.find(fd, 'frontendEndpoints', fl('--name'))
+            if not fe: raise Failure(f'frontend {fl("--name")} not found')
+            return fe
+        if sub == 'frontend-endpoint enable-https':
+            fe = self.find(fd, 'frontendEndpoints', fl('--name'))
+            if not fe: raise Failure(f'frontend {fl("--name")} not found')
+            fe['customHttpsProvisioningState'] = 'Enabled'
+            fe['customHttpsConfiguration'] = {
+                'certificateSource': fl('--certificate-source'), 'minimumTlsVersion': fl('--minimum-tls-version'),
+                'secretName': fl('--secret-name'), 'secretVersion': fl('--secret-version'),
+                'vault': {'id': fl('--vault-id')} if fl('--vault-id') else None}
+            return fe
+        if sub in ['probe create', 'probe update']:
+            return self.put(fd, 'healthProbeSettings', {
+                'name': fl('--name'), 'path': fl('--path'), 'protocol': fl('--protocol'), 'intervalInSeconds': int(fl('--interval')),
+                'healthProbeMethod': fl('--probeMethod', 'HEAD'), 'enabledState': fl('--enabled', 'Enabled')})
+        if sub in ['load-balancing create', 'load-balancing update']:
+            return self.put(fd, 'loadBalancingSettings', {
+                'name': fl('--name'), 'sampleSize': int(fl('--sample-size')), 'successfulSamplesRequired': int(fl('--successful-samples-required')),
+                'additionalLatencyMilliseconds': int(fl('--additional-latency'))})
+        if sub == 'backend-pool create':
+            return self.put(fd, 'backendPools', {
+                'name': fl('--name'), 'healthProbeSettings': self.ref(fd, 'healthProbeSettings', fl('--probe')),
+                'loadBalancingSettings': self.ref(fd, 'loadBalancingSettings', fl('--load-balancing')),
+                'backends': [{'address': fl('--address'), 'backendHostHeader': fl('--backend-host-header', fl('--address')),
+                              'httpPort': int(fl('--http-port', '80')), 'httpsPort': int(fl('--https-port', '443')),
+                              'priority': int(fl('--priority', '1')), 'weight': int(fl('--weight', '50')), 'enabledState': 'Enabled'}]})
+        if sub == 'update':
+            self.generic_set(fd, flags)
+            fd['etag'] += 1
+            return self.unwrap(self.arm(fd))
+        if sub == 'backend-pool update':
+            pool = self.find(fd, 'backendPools', fl('--name'))
+            if not pool: raise Failure(f'pool {fl("--name")} not found')
+            self.generic_set(pool, flags)
+            fd['etag'] += 1
+            return pool
+        if sub == 'backend-pool show':
+            pool = self.find(fd, 'backendPools', fl('--name'))
+            if not pool: raise Failure(f'pool {fl("--name")} not found')
+            return pool
+        if sub in ['routing-rule create', 'routing-rule update']:
+            rule = self.find(fd, 'routingRules', fl('--name'))
+            if sub.endswith('update'):
+                if not rule: raise Failure(f'routing rule {fl("--name")} not found')
+                if '--rules-engine' in flags:
+                    rule['rulesEngine'] = self.ref(fd, 'rulesEngines', fl('--rules-engine'))
+                fd['etag'] += 1
+                return rule
+            if fl('--route-type') == 'Forward':
+                route = {'@odata.type': FORWARD, 'backendPool': self.ref(fd, 'backendPools', fl('--backend-pool')),
+                         'forwardingProtocol': fl('--forwarding-protocol'), 'customForwardingPath': fl('--custom-forwarding-path')}
+            else:
+                route = {'@odata.type': REDIRECT, 'redirectType': fl('--redirect-type'), 'redirectProtocol': fl('--redirect-protocol'),
+                         'customHost': fl('--custom-host'), 'customPath': fl('--custom-path')}
+            return self.put(fd, 'routingRules', {
+                'name': fl('--name'), 'enabledState': 'Disabled' if fl('--disabled') == 'true' else 'Enabled',
+                'frontendEndpoints': [self.ref(fd, 'frontendEndpoints', x) for x in flags['--frontend-endpoints']],
+                'patternsToMatch': flags['--patterns'], 'acceptedProtocols': flags['--accepted-protocols'],
+                'routeConfiguration': route, 'rulesEngine': (rule or {}).get('rulesEngine')})
+        if sub == 'rules-engine list':
+            return fd['rulesEngines']
+
+        if sub.startswith('rules-engine rule'):
+            return self.engine_command(fd, sub[len('rules-engine rule '):], flags, fl)
+        raise Failure(f'emulator: unsupported command az {w}')
+
+    @classmethod
+    def generic_set(cls, resource: dict, flags: dict):
+        ''' apply the --set path=value arguments of a generic update, list items are selected with [key=value] '''
+        for setting in flags.get('--set') or []:
+            # the assignment is the first = outside a [key=value] selector
+            depth = 0
+            for index, c in enumerate(setting):
+                depth += {'[': 1, ']': -1}.get(c, 0)
+                if c == '=' and not depth:
+                    break
+            path, value = setting[:index], setting[index + 1:]
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            target = resource
+            keys = path.split('.')
+            for k in keys[:-1]:
+                if k.endswith(']'):
+                    k, _, selector = k[:-1].partition('[')
+                    field, _, match = selector.partition('=')
+                    target = next((i for i in target.get(k) or [] if i.get(field) == match), None)
+                    if target is None: raise Failure(f'no {k} item with {selector}')
+                else:
+                    target = target.setdefault(k, {})
+            target[keys[-1]] = value
+
+    def engine_command(self, fd: dict, sub: str, flags: dict, fl):
+        engine = self.find(fd, 'rulesEngines', fl('--rules-engine-name'))
+        if sub in ['create', 'update']:
+            if not engine:
+                engine = self.put(fd, 'rulesEngines', {'name': fl('--rules-engine-name'), 'rules': []})
+            rule = next((r for r in engine['rules'] if r['name'] == fl('--name')), None)
+            if not rule:
+                rule = {'name': fl('--name'), 'priority': 0, 'matchConditions': [], 'matchProcessingBehavior': 'Continue',
+                        'action': {'requestHeaderActions': [], 'responseHeaderActions': [], 'routeConfigurationOverride': None}}
+                engine['rules'].append(rule)
+            rule['priority'] = int(fl('--priority'))
+            if '--action-type' in flags:
+                rule['action']['requestHeaderActions'] = [{'headerActionType': fl('--header-action'), 'headerName': fl('--header-name'), 'value': fl('--header-value')}]
+            return engine
+
+        if not engine: raise Failure(f'rules engine {fl("--rules-engine-name")} not found')
+        rule = next((r for r in engine['rules'] if r['name'] == fl('--name')), None)
+        if not rule: raise Failure(f'rule {fl("--name")} not found')
+        action = rule['action']
+        _type = fl('--action-type') or ''
+        headers = 'requestHeaderActions' if _type == 'RequestHeader' else 'responseHeaderActions'
+
+        if sub == 'show':
+            return rule
+        if sub == 'action list':
+            return action
+        if sub == 'condition list':
+            return rule['matchConditions']
+        if sub == 'action add':
+            if 'Header' in _type:
+                action[headers].append({'headerActionType': fl('--header-action'), 'headerName': fl('--header-name'), 'value': fl('--header-value')})
+            elif _type == 'ForwardRouteOverride':
+                action['routeConfigurationOverride'] = {
+                    '@odata.type': FORWARD, 'backendPool': self.ref(fd, 'backendPools', fl('--backend-pool')),
+                    'forwardingProtocol': fl('--forwarding-protocol'), 'customForwardingPath': fl('--custom-forwarding-path'),
+                    'cacheConfiguration': {'queryParameterStripDirective': 'StripNone', 'dynamicCompression': 'Enabled'} if fl('--caching') == 'Enabled' else None}
+            else:
+                action['routeConfigurationOverride'] = {
+                    '@odata.type': REDIRECT, 'redirectType': fl('--redirect-type'), 'redirectProtocol': fl('--redirect-protocol'),
+                    'customHost': fl('--custom-host'), 'customPath': fl('--custom-path'), 'customQueryString': fl('--custom-query-string')}
+            return action
+        if sub == 'action remove':
+            if 'Header' in _type:
+                del action[headers][int(fl('--index'))]
+            else:
+                action['routeConfigurationOverride'] = None
+            return action
+        if sub == 'condition add':
+            rule['matchConditions'].append({
+                'rulesEngineMatchVariable': fl('--match-variable'), 'rulesEngineOperator': fl('--operator'),
+                'rulesEngineMatchValue': flags.get('--match-values'), 'negateCondition': fl('--negate-condition') == 'true',
+                'transforms': flags.get('--transforms') or []})
+            return rule['matchConditions']
+        if sub == 'condition remove':
+            del rule['matchConditions'][int(fl('--index'))]
+            return rule['matchConditions']
+        raise Failure(f'emulator: unsupported command rules-engine rule {sub}')
+
+    # management api emulation
+
+    def rest(self, method: str, url: str, body: str = None, headers: dict = None):
+        """
+        :return: (http status, response text) for a management api request
+        """
+        path = urllib.parse.urlsplit(url).path.replace('{subscriptionId}', self.subscription)
+        parts = path.strip('/').split('/')
+        # subscriptions/<s>/resourceGroups/<g>/providers/Microsoft.Network/frontDoors/<fd>[/<kind>[/<name>]]
+        if len(parts) < 8 or parts[6].lower() != 'frontdoors':
+            return 404, json.dumps({'error': {'code': 'NotFound', 'message': path}})
+        with self._lock:
+            fd = self.front_door(parts[3], parts[7])
+            kind = parts[8] if len(parts) > 8 else None
+            name = parts[9] if len(parts) > 9 else None
+            if method == 'get':
+                if not kind:
+                    etag = {k.lower(): v for k, v in (headers or {}).items()}.get('if-none-match')
+                    status, document = 200, json.dumps(self.arm(fd))
+                    if self.etags and etag and etag.strip('"') == str(fd['etag']):
+                        status, document = 304, ''
+                    if self.on_read:
+                        self.on_read(fd)
+                    return status, document
+                if not name:
+                    return 200, json.dumps({'value': [self.wrap(x) for x in fd.get(kind) or []]})
+                item = self.find(fd, kind, name) if kind in KINDS else None
+                if not item:
+                    return 404, json.dumps({'error': {'code': 'ResourceNotFound', 'message': f'{kind}/{name}'}})
+                return 200, json.dumps(self.wrap(item))
+            if method == 'put':
+                _body = json.loads(body)
+                etag = {k.lower(): v for k, v in (headers or {}).items()}.get('if-match')
+                if not kind:
+                    if self.etags and etag and etag.strip('"') != str(fd['etag']):
+                        return 412, json.dumps({'error': {'code': 'PreconditionFailed', 'message': 'etag mismatch'}})
+                    for k in KINDS[:-1]:
+                        fd[k] = [dict(self.unwrap(x), id=f'{fd["id"]}/{k}/{x["name"]}') for x in _body['properties'].get(k) or []]
+                    fd['etag'] += 1
+                    return 200, json.dumps(self.arm(fd))
+                if kind == 'rulesEngines' and name:
+                    return 200, json.dumps(self.wrap(self.put(fd, 'rulesEngines', {'name': name, 'rules': _body['properties']['rules']})))
+            return 405, json.dumps({'error': {'code': 'MethodNotAllowed', 'message': f'{method} {path}'}})
+
+
+class _AzHandler(socketserver.StreamRequestHandler):
+    ''' one json argument list in, one json [exit code, stdout, stderr] out '''
+    def handle(self):
+        argv = json.loads(self.rfile.readline())
+        self.wfile.write((json.dumps(self.server.emulator.run(argv)) + '\n').encode('utf-8'))
+
+
+class _ArmHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, method: str):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else None
+        emulator = self.server.emulator
+        emulator.count(f'arm {method}')
+        time.sleep(emulator.read_latency if method == 'get' else emulator.write_latency)
+        status, text = emulator.rest(method, self.path, body, dict(self.headers))
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond('get')
+
+    def do_PUT(self):
+        self.respond('put')
+
+
+class Server(object):
+    '''
+    serves one emulator to the bench az shim over a unix socket and to the arm executor over http
+    '''
+    def __init__(self, emulator: FrontDoorEmulator, socket_path: str):
+        self.emulator = emulator
+        self.socket_path = socket_path
+        self.az = socketserver.ThreadingUnixStreamServer(socket_path, _AzHandler)
+        self.az.daemon_threads = True
+        self.az.emulator = emulator
+        self.arm = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ArmHandler)
+        self.arm.daemon_threads = True
+        self.arm.emulator = emulator
+        self.arm_endpoint = f'http://127.0.0.1:{self.arm.server_address[1]}'
+        self.threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in [self.az, self.arm]]
+        for t in self.threads:
+            t.start()
+
+    def close(self):
+        for s in [self.az, self.arm]:
+            s.shutdown()
+            s.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
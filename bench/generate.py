@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+'''
+This writes a synthetic route manager config for the benchmarks
+
+Every route gets its own frontend, every fifth route shares the previous pool, every tenth frontend has a key vault
+certificate, and one rules engine is generated for every ten routes, with conditions, header actions and a route
+override, associated with one of the routes.
+'''
+import argparse
+import yaml
+
+
+def generate(routes: int, rules_per_engine: int = 5, fd_name: str = 'bench-fd', fd_group: str = 'bench-rg'):
+    """
+    :return: config dict with the given number of routes
+    """
+    routing_rules = []
+    pool = None
+    for i in range(routes):
+        frontend = {f'fe-{i}': None, 'exists': False, 'host-name': f'r{i}.bench.example.com'}
+        if i % 10 == 9:
+            frontend.update({'enable-ssl': True, 'certificate-type': 'AzureKeyVault', 'secret-name': f'cert-{i}', 'secret-version': 'Latest',
+                             'vault-id': f'/subscriptions/bench/resourceGroups/{fd_group}/providers/Microsoft.KeyVault/vaults/bench-kv'})
+        if pool is None or i % 5 != 4:
+            pool = {f'pool-{i}': {'exists': False,
+                                  'backends': [{f'b{i}-{n}.bench.example.com': None} for n in range(2)],
+                                  'probe': {'path': f'/health/{i % 3}'}, 'load-balancing': {'sample-size': 4}}}
+        rule = {f'route-{i}': None, 'frontends': [frontend], 'patterns': [f'/r{i}/*']}
+        if i % 7 == 6:
+            rule.update({'ruletype': 'Redirect', 'destination-host': f'moved{i}.bench.example.com'})
+        else:
+            rule.update({'ruletype': 'Forward', 'backend-pool': pool})
+        routing_rules.append(rule)
+
+    engine_rules = []
+    associations = []
+    forwards = [list(r)[0] for r in routing_rules if r['ruletype'] == 'Forward']
+    for e in range(max(1, routes // 10)):
+        rules = []
+        for r in range(rules_per_engine):
+            rules.append({f'rule-{r}': None,
+                          'conditions': [{f'c{r}': None, 'type': 'QueryString', 'operator': 'Contains', 'match-value': f'v{r}'}],
+                          'actions': [{f'a{r}': None, 'type': 'ResponseHeader', 'header-action': 'Overwrite', 'header-name': 'X-Engine', 'header-value': f'e{e}r{r}'},
+                                      {f'o{r}': None, 'type': 'ForwardRouteOverride', 'backend-pool': 'pool-0'}]})
+        engine_rules.append({f'engine{e}': None, 'rules': rules})
+        associations.append({f'engine{e}': [forwards[(e * 10) % len(forwards)]]})
+
+    return {'front-door-name': fd_name, 'front-door-group': fd_group, 'routing-rules': routing_rules,
+            'engine-rules': engine_rules, 'engine-associations': associations}
+
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    'routes',
+    help="number of routing rules",
+    type=int)
+
+  parser.add_argument(
+    '--rules-per-engine',
+    help="rules in each generated rules engine (default 5)",
+    type=int,
+    default=5)
+
+  parser.add_argument(
+    '--output',
+    help="config file to write, stdout by default")
+
+  _args = vars(parser.parse_args())
+  _config = yaml.dump(generate(_args['routes'], _args['rules_per_engine']), sort_keys=False)
+  if _args['output']:
+      with open(_args['output'], 'w') as file:
+          file.write(_config)
+  else:
+      print(_config, end='')
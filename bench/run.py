@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+'''
+This benchmarks frontdoor_route_manager.py against the in memory front door emulator
+
+For every size and scenario a config is generated and applied twice to a fresh emulated front door: a cold run
+that creates everything and a repeat run that should find nothing to change. Each run reports wall time, the
+az and management api calls the emulator served, by command, and the peak memory of the tool process.
+The emulator answers bench/bin/az over a unix socket and the arm executor over http, with the configured
+latency per read and per write.
+The document scenarios then get a third, conflict run: the front door is edited, as from the portal, right after
+the tool reads it, and the run must stop without overwriting that edit. --no-etag serves the front door without an
+etag, so the tool can not send If-Match.
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+import threading
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+import emulator
+import generate
+import yaml
+
+TOOL = os.path.join(os.path.dirname(BENCH), 'frontdoor_route_manager.py')
+
+SCENARIOS = {
+    'commands': ['--apply-mode', 'commands', '--executor', 'az'],
+    'engine-rules': ['--apply-mode', 'commands', '--executor', 'az', '--engine-apply', 'rules'],
+    'document': ['--apply-mode', 'document', '--executor', 'az'],
+    'document-arm': ['--apply-mode', 'document', '--executor', 'arm'],
+}
+
+
+def run_tool(config: str, args: list, env: dict, server, timeout: int):
+    """
+    :return: result dict of one tool run, calls are counted by the emulator
+    """
+    server.emulator.reset_counts()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, TOOL, '--config', config] + args, env=env, universal_newlines=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    output = process.stdout.read()
+    process.stdout.close()
+    # wait4 gives the peak resident size of the tool process itself, the az shims it starts are not counted
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    timer.cancel()
+    calls = dict(server.emulator.calls)
+    lost = server.emulator.lost_updates
+    return {
+        'exit': os.waitstatus_to_exitcode(status), 'wall': round(elapsed, 3), 'calls': sum(calls.values()),
+        'writes': sum(v for k, v in calls.items() if not (k.split()[-1] in emulator.READ_VERBS or k in ['rest get', 'arm get'])),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1), 'lost_updates': lost, 'by_command': calls, 'output': output
+    }
+
+
+def concurrent_edit(fd):
+    """
+    clear pool-0's backends once, the next front door read, as a portal edit between the tool's read and its write
+    :return: callable returning True when the edit is still there
+    """
+    edited = []
+
+    def edit(document: dict):
+        if not edited:
+            fd.find(document, 'backendPools', 'pool-0')['backends'] = []
+            document['etag'] += 1
+            edited.append(True)
+    fd.on_read = edit
+
+    def kept():
+        with fd._lock:
+            fd.on_read = None
+            return bool(edited) and not fd.find(fd.front_door('bench-rg', 'bench-fd'), 'backendPools', 'pool-0')['backends']
+    return kept
+
+
+def bench(sizes: list, scenarios: list, read_latency: float, write_latency: float, parallelism: int, timeout: int, etags: bool = True):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fdrm-bench-') as work:
+        for size in sizes:
+            config = os.path.join(work, f'bench-{size}.cfg')
+            _config = generate.generate(size)
+            with open(config, 'w') as file:
+                yaml.dump(_config, file, sort_keys=False)
+            # the same routes with one more pattern, so the conflict run has a front door write to make
+            changed = os.path.join(work, f'bench-{size}-changed.cfg')
+            _config['routing-rules'][0]['patterns'].append('/extra/*')
+            with open(changed, 'w') as file:
+                yaml.dump(_config, file, sort_keys=False)
+
+            for scenario in scenarios:
+                fd = emulator.FrontDoorEmulator(read_latency, write_latency, etags=etags)
+                server = emulator.Server(fd, os.path.join(work, 'az.sock'))
+                env = dict(os.environ)
+                env.update({
+                    'PATH': os.path.join(BENCH, 'bin') + os.pathsep + env.get('PATH', ''),
+                    'FDRM_BENCH_SOCKET': server.socket_path, 'FDRM_ARM_ENDPOINT': server.arm_endpoint,
+                    'FDRM_ARM_TOKEN': 'bench', 'ARM_SUBSCRIPTION_ID': fd.subscription,
+                    'FDRM_CACHE_DIR': os.path.join(work, f'cache-{scenario}')
+                })
+                phases = ['cold', 'repeat'] + (['conflict'] if scenario.startswith('document') else [])
+                try:
+                    for phase in phases:
+                        kept = concurrent_edit(fd) if phase == 'conflict' else None
+                        result = run_tool(changed if kept else config, SCENARIOS[scenario] + ['--parallelism', str(parallelism)], env, server, timeout)
+                        result.update({'size': size, 'scenario': scenario, 'run': phase})
+                        if kept:
+                            result['edit_kept'] = kept()
+                        results.append(result)
+                        print(f'{size:>6} {scenario:<14} {phase:<7} exit {result["exit"]:>3} {result["wall"]:>9.2f}s {result["calls"]:>7} calls '
+                              f'{result["writes"]:>7} writes {result["peak_rss_mb"]:>8.1f} MB')
+                        if 'edit_kept' in result:
+                            print(f'{"":>6} {"":<14} {"":<7} concurrent edit {"kept" if result["edit_kept"] else "OVERWRITTEN"}')
+                        if result['lost_updates']:
+                            print(f'{"":>6} {"":<14} {"":<7} {result["lost_updates"]} front door writes overwritten by a concurrent write')
+                        sys.stdout.flush()
+                        if result['exit'] != 0 and phase != 'conflict':
+                            print(result['output'][-4000:])
+                finally:
+                    server.close()
+    return results
+
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    '--sizes',
+    help="comma separated route counts (default 10,100,1000)",
+    default='10,100,1000')
+
+  parser.add_argument(
+    '--scenarios',
+    help=f"comma separated scenarios out of {','.join(SCENARIOS)} (default all)",
+    default=','.join(SCENARIOS))
+
+  parser.add_argument(
+    '--latency-read',
+    help="seconds every emulated read takes (default 0.05)",
+    type=float,
+    default=0.05)
+
+  parser.add_argument(
+    '--latency-write',
+    help="seconds every emulated write takes (default 0.2)",
+    type=float,
+    default=0.2)
+
+  parser.add_argument(
+    '--parallelism',
+    help="passed to the tool (default 8)",
+    type=int,
+    default=8)
+
+  parser.add_argument(
+    '--timeout',
+    help="seconds a single tool run may take (default 3600)",
+    type=int,
+    default=3600)
+
+  parser.add_argument(
+    '--no-etag',
+    help="serve the front door document without an etag",
+    action='store_true')
+
+  parser.add_argument(
+    '--json',
+    help="also write the results, with per command call counts, to this file")
+
+  _args = vars(parser.parse_args())
+  _scenarios = [s for s in _args['scenarios'].split(',') if s]
+  for s in _scenarios:
+      if not s in SCENARIOS:
+          parser.error(f'unknown scenario {s}')
+
+  print(f'{"routes":>6} {"scenario":<14} {"run":<7} {"":>8} {"wall":>10} {"":>13} {"":>14} {"peak":>11}')
+  _results = bench([int(s) for s in _args['sizes'].split(',') if s], _scenarios, _args['latency_read'], _args['latency_write'],
+                   _args['parallelism'], _args['timeout'], not _args['no_etag'])
+
+  if _args['json']:
+      with open(_args['json'], 'w') as file:
+          json.dump([{k: v for k, v in r.items() if k != 'output'} for r in _results], file, indent=2)
+      print(f'results written to {_args["json"]}')
+
+  # a conflict run may stop or plan again over the edit, it only fails when the edit is overwritten
+  sys.exit(1 if any(not r['edit_kept'] if 'edit_kept' in r else r['exit'] != 0 for r in _results) else 0)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''
+This runs frontdoor_route_manager.py --watch against the in memory front door emulator and checks it follows drift
+
+The tool is started on a generated config and left to converge, then the emulated front door and the config are
+changed under it: a pool's backends are cleared as a portal edit would, the config file is touched without a change
+and then a route gets an extra pattern. Every step reports the calls the emulator served and the step fails when
+the tool wrote too much or did not undo the change. --no-etag serves the front door without an etag, as classic
+front doors usually are.
+'''
+import os
+import re
+import sys
+import argparse
+import subprocess
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+import emulator
+import generate
+import yaml
+
+TOOL = os.path.join(os.path.dirname(BENCH), 'frontdoor_route_manager.py')
+
+
+def writes(calls: dict):
+    return sum(v for k, v in calls.items() if not (k.split()[-1] in emulator.READ_VERBS or k in ['rest get', 'arm get']))
+
+
+def watch(routes: int, interval: float, settle: float, etags: bool):
+    """
+    :return: list of (step, calls, failure or None)
+    """
+    steps = []
+    with tempfile.TemporaryDirectory(prefix='fdrm-watch-') as work:
+        config = os.path.join(work, 'watch.cfg')
+        with open(config, 'w') as file:
+            yaml.dump(generate.generate(routes), file, sort_keys=False)
+
+        fd = emulator.FrontDoorEmulator(etags=etags)
+        server = emulator.Server(fd, os.path.join(work, 'az.sock'))
+        env = dict(os.environ)
+        env.update({
+            'PATH': os.path.join(BENCH, 'bin') + os.pathsep + env.get('PATH', ''),
+            'FDRM_BENCH_SOCKET': server.socket_path, 'ARM_SUBSCRIPTION_ID': fd.subscription,
+            'FDRM_CACHE_DIR': os.path.join(work, 'cache'), 'PYTHONUNBUFFERED': '1'
+        })
+        log = os.path.join(work, 'watch.log')
+        with open(log, 'w') as output:
+            process = subprocess.Popen([sys.executable, TOOL, '--config', config, '--watch', '--interval', str(interval)],
+                                       env=env, stdout=output, stderr=subprocess.STDOUT)
+
+        def step(name: str, check):
+            time.sleep(settle)
+            calls = dict(fd.calls)
+            fd.reset_counts()
+            steps.append((name, calls, check(calls)))
+
+        def pool_backends():
+            with fd._lock:
+                return (fd.find(fd.front_door('bench-rg', 'bench-fd'), 'backendPools', 'pool-0') or {}).get('backends')
+
+        try:
+            step('first pass', lambda c: None if writes(c) else 'nothing was created')
+            step('idle', lambda c: f'{writes(c)} writes' if writes(c) else None)
+
+            fd.run(['az', 'network', 'front-door', 'backend-pool', 'update', '-f', 'bench-fd', '-g', 'bench-rg', '--name', 'pool-0', '--set', 'backends=[]'])
+            fd.reset_counts()
+            step('pool drift', lambda c: None if pool_backends() else 'the cleared backends were not restored')
+            step('idle', lambda c: f'{writes(c)} writes' if writes(c) else None)
+
+            os.utime(config)
+            step('config touched', lambda c: f'{writes(c)} writes' if writes(c) else None)
+
+            with open(config) as file:
+                _config = yaml.safe_load(file)
+            _config['routing-rules'][0]['patterns'].append('/extra/*')
+            with open(config, 'w') as file:
+                yaml.dump(_config, file, sort_keys=False)
+            step('config changed', lambda c: None if writes(c) else 'the changed route was not written')
+        finally:
+            process.terminate()
+            process.wait()
+            server.close()
+
+        with open(log) as file:
+            passes = re.findall(r'===== watch pass (.*) =====', file.read())
+    return steps, passes
+
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    '--routes',
+    help="number of generated routes (default 10)",
+    type=int,
+    default=10)
+
+  parser.add_argument(
+    '--interval',
+    help="watch interval passed to the tool (default 1)",
+    type=float,
+    default=1)
+
+  parser.add_argument(
+    '--settle',
+    help="seconds each step waits for the tool before it is checked (default 5)",
+    type=float,
+    default=5)
+
+  parser.add_argument(
+    '--no-etag',
+    help="serve the front door document without an etag",
+    action='store_true')
+
+  _args = vars(parser.parse_args())
+  _steps, _passes = watch(_args['routes'], _args['interval'], _args['settle'], not _args['no_etag'])
+  for name, calls, failure in _steps:
+      print(f'{name:<16} {sum(calls.values()):>5} calls {writes(calls):>5} writes  {failure or "ok"}')
+  print('passes: ' + ', '.join(_passes))
+  sys.exit(1 if any(failure for _, _, failure in _steps) else 0)
@@ -33,7 +33,7 @@ class Action(object):
                 print('url rewrite is Disabled')
 
             self.forward_protocol = cfg['forward-protocol'] if 'forward-protocol' in cfg else 'Https'
-            _caching = cfg['enable-caching'] if 'enable-caching' in cfg else 'False'
+            _caching = cfg['enable-caching'] if 'enable-caching' in cfg else False
             if not _caching:
                 self.enable_caching = 'Disabled'
             else:
@@ -72,10 +72,45 @@ class Action(object):
             self.command.extend(['--redirect-type', self.redirect_type])
             if not self.destination_host == 'Preserve':
                 self.command.extend(['--custom-host', self.destination_host])
-            if not self.destination_host == 'Preserve':
+            if not self.destination_path == 'Preserve':
                 self.command.extend(['--custom-path', self.destination_path])
             if not self.query_string == 'Preserve':
                 self.command.extend(['--custom-query-string', self.query_string])
 
         #print(f'    --- ACTION {" ".join(self.command)}\n')
 
+    def desired(self):
+        """
+        :return: the action as it appears in the live rule action block
+        """
+        if self.action_type == 'RequestHeader' or self.action_type == 'ResponseHeader':
+            return {'headerActionType': self.header_action, 'headerName': self.header_name, 'value': self.header_value}
+
+        if self.action_type == 'ForwardRouteOverride':
+            return {
+                'backendPool': {'id': self.backend_pool},
+                'forwardingProtocol': self.forward_protocol,
+                'customForwardingPath': self.forward_path
+            }
+
+        return {
+            'redirectType': self.redirect_type,
+            'redirectProtocol': self.redirect_protocol,
+            'customHost': None if self.destination_host == 'Preserve' else self.destination_host,
+            'customPath': None if self.destination_path == 'Preserve' else self.destination_path,
+            'customQueryString': None if self.query_string == 'Preserve' else self.query_string
+        }
+
+    def compile(self):
+        """
+        :return: the action as arm json for a whole rules engine PUT
+        """
+        _compiled = self.desired()
+        if self.action_type == 'ForwardRouteOverride':
+            _compiled['@odata.type'] = '#Microsoft.Azure.FrontDoor.Models.FrontdoorForwardingConfiguration'
+            _compiled['cacheConfiguration'] = None
+            if self.enable_caching == 'Enabled':
+                _compiled['cacheConfiguration'] = {'queryParameterStripDirective': 'StripNone', 'dynamicCompression': 'Enabled'}
+        if self.action_type == 'RedirectRouteOverride':
+            _compiled['@odata.type'] = '#Microsoft.Azure.FrontDoor.Models.FrontdoorRedirectConfiguration'
+        return _compiled
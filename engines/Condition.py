@@ -38,8 +38,10 @@ class Condition(object):
 
         if self.operator[:3].lower() == 'not':
             self.negative_condition = True
+            self.operator = self.operator[3:]
 
         self.match_value = cfg['match-value']
+        self.match_values = self.match_value if isinstance(self.match_value, list) else [self.match_value]
         self.transform = cfg['transform'] if 'transform' in cfg else None #should check theser against valid values
 
         if not self.type in supported_types:
@@ -55,12 +57,24 @@ class Condition(object):
         self.command.extend(['--match-variable', self.type])
 
         self.command.extend(['--operator', self.operator])
-        self.command.extend(['--match-values', self.match_value])
+        self.command.extend(['--match-values'])
+        self.command.extend([str(v) for v in self.match_values])
 
         if self.negative_condition:
-            self.command.extend(['--negate-condition', self.negative_condition.lower()])
+            self.command.extend(['--negate-condition', 'true'])
         if self.transform:
             self.command.extend(['--transforms', self.transform])
 
         #print(f'    --- CONDITION {" ".join(self.command)}\n')
 
+    def desired(self):
+        """
+        :return: the condition as it appears in the live rule matchConditions
+        """
+        return {
+            'rulesEngineMatchVariable': self.type,
+            'rulesEngineOperator': self.operator,
+            'rulesEngineMatchValue': [str(v) for v in self.match_values],
+            'negateCondition': self.negative_condition,
+            'transforms': [self.transform] if self.transform else []
+        }
@@ -1,8 +1,6 @@
 from . import Condition
 from . import Action
-import subprocess
-import traceback
-import json
+from routes import Utility as util
 
 class Rule(object):
     '''
@@ -14,122 +12,51 @@ class Rule(object):
     the rule. But it is valid in the action add api command. THIS SEEMS LIKE A AZURE API BUG.
     So for our case we always create a "noop" action as the action in the rule create command.
     The rule can only be created whilst specifying an Action.
+    A live route override can only be removed and added again with the cli, which leaves the rule without it in
+    between, so a rule whose override changes is written whole with a PUT of its rules engine instead.
 
     This is similar api behavior ad when adding backends to pools
     '''
 
+    noop_action = {'headerActionType': 'Overwrite', 'headerName': 'route-manager-noop', 'value': 'no-rule-association'}
+
     @classmethod
     def remove_rule_action(cls, rule: str, engine: str, action_type: str, index: int, fd_name: str, fd_group: str):
         """
-        :return: True|False if action was removed
+        :return: command to remove a rule action, index is only used by the header action types
         """
-        if not 'Header' in action_type:
-            result = subprocess.run(
-                ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'remove', '--name', rule, '--rules-engine-name', engine,
-                 '-f', fd_name, '-g', fd_group, '--action-type', action_type], capture_output=True)
-            cmd = ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'remove', '--name', rule, '--rules-engine-name', engine, '-f', fd_name, '-g', fd_group, '--action-type', action_type]
-            print(f'\n{" ".join(cmd)}')
-
-        else:
-            result = subprocess.run(
-                ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'remove', '--name', rule, '--rules-engine-name', engine,
-                 '-f', fd_name, '-g', fd_group, '--action-type', action_type, '--index', str(index)], capture_output=True)
-            cmd = ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'remove', '--name', rule, '--rules-engine-name', engine, '-f', fd_name, '-g', fd_group, '--action-type', action_type, '--index', str(index)]
-            print(f'\n{" ".join(cmd)}')
-
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}\nerror code: {result.returncode}')
-            return False
-
-        if result.returncode:
-            print(f'error: {result.returncode}')
-            return False
-
-        return True
+        cmd = ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'remove', '--name', rule, '--rules-engine-name', engine,
+               '-f', fd_name, '-g', fd_group, '--action-type', action_type]
+        if 'Header' in action_type:
+            cmd.extend(['--index', str(index)])
+        return cmd
 
 
     @classmethod
     def remove_rule_condition(cls, rule: str, engine: str, index: int, fd_name: str, fd_group: str):
         """
-        :return: True|False if condition was removed
+        :return: command to remove a rule condition
         """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'condition', 'remove', '--name', rule, '--rules-engine-name', engine,
-             '-f', fd_name, '-g', fd_group, '--index', str(index)], capture_output=True)
-        cmd = ['az', 'network', 'front-door', 'rules-engine', 'rule', 'condition', 'remove', '--name', rule, '--rules-engine-name', engine, '-f', fd_name, '-g', fd_group, '--index', str(index)]
-        print(f'\n{" ".join(cmd)}')
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}\nerror code: {result.returncode}')
-            return False
-        return True
-
-        if result.returncode:
-            print(f'error: {result.returncode}')
-            return False
+        return ['az', 'network', 'front-door', 'rules-engine', 'rule', 'condition', 'remove', '--name', rule, '--rules-engine-name', engine,
+                '-f', fd_name, '-g', fd_group, '--index', str(index)]
 
     @classmethod
-    def rule_exists(cls, rule: str, engine: str, fd_name: str, fd_group: str):
+    def diff_slots(cls, desired: list, live: list):
         """
-        :return: True|False
+        :return: (live indexes to remove, highest first, desired indexes to append)
+        Slots can only be removed by index or appended at the end, so the longest run of desired items that
+        already appear in order in the live list is kept and only the remaining slots are rewritten.
         """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'show', '--name', rule, '--rules-engine-name', engine,
-             '-f', fd_name, '-g', fd_group], capture_output=True)
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}\nerror code: {result.returncode}')
-            return False
-
-        if result.returncode:
-            print(f'error: {result.returncode}')
-            return False
-
-        return True
-
-    @classmethod
-    def get_all_rule_conditions(cls, rule: str, engine: str, fd_name: str, fd_group: str):
-        """
-        :return:
-        """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'condition', 'list', '--name', rule, '--rules-engine-name', engine,
-             '-f', fd_name, '-g', fd_group], capture_output=True)
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}\nerror code: {result.returncode}')
-            return {}
-
-        if result.returncode:
-            print(f'error: {result.returncode}')
-            return False
-
-        return json.loads(result.stdout)
-
-
-    @classmethod
-    def get_all_rule_actions(cls, rule: str, engine: str, fd_name: str, fd_group: str):
-        """
-        :return: requestHeaderActions[], responseHeaderActions[], routeConfigurationOverride{}
-        """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'action', 'list', '--name', rule, '--rules-engine-name', engine,
-             '-f', fd_name, '-g', fd_group], capture_output=True)
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}\nerror code: {result.returncode}')
-            return {}
-
-        if result.returncode:
-            print(f'error: {result.returncode}')
-            return False
-
-        data = json.loads(result.stdout)
-
-        return data['requestHeaderActions'], data['responseHeaderActions'], data['routeConfigurationOverride']
-
-    def __init__(self, action: str, cfg: dict, engine_name: str, priority: int, fd_name: str, fd_group: str):
+        keep = 0
+        removals = []
+        for index, item in enumerate(live):
+            if keep < len(desired) and not util.differs(desired[keep], item):
+                keep += 1
+            else:
+                removals.append(index)
+        return list(reversed(removals)), list(range(keep, len(desired)))
+
+    def __init__(self, action: str, cfg: dict, engine_name: str, priority: int, fd_name: str, fd_group: str, state):
         if not cfg:
             raise ValueError('cfg cannot be None')
 
@@ -143,56 +70,16 @@ class Rule(object):
 
         self.name = next(iter(cfg))
 
-        ''' TODO
-        need to check actions and conditions for existing. Since they do not have names or other identifiers, we will remove and re-add
-        all actions and conditions with the exception of the default noop action. This can be realized by header-name == route-manager-noop
-        in a lookup of all actions.
-        the remove actions and conditions should be done here BEFORE this class instance is returned
-        Removing actions and conditions is done by index which is not exposed in a json properties or in the portal. It's the order
-        that the action/conditions were created. So for actions, NOOP is always index 0. We need to create the index from the return
-        lookup of all actions and conditions. Index corrosponds to the order returned in json.
-        '''
-
-        if self.rule_exists(self.name, self.engine_name, fd_name, fd_group):
+        self.fd_name = fd_name
+        self.fd_group = fd_group
+        self.live = state.engine_rule(self.engine_name, self.name)
 
-            # REMOVE ACTIONS
-            request, response, override = self.get_all_rule_actions(self.name, self.engine_name, fd_name, fd_group)
-
-            if override:
-                print('remove the routeConfigurationOverride action.....')
-                if 'backendPool' in override:
-                    result = self.remove_rule_action(self.name, self.engine_name, 'ForwardRouteOverride', 99, fd_name, fd_group)
-                else:
-                    result = self.remove_rule_action(self.name, self.engine_name, 'RedirectRouteOverride', 99, fd_name, fd_group)
-            if request:
-                index = len(request)
-                if index: index-=1
-                while index:
-                    print(f'removing rule RequestHeader action index {index}, 0 is reserved for NOOP.....')
-                    result = self.remove_rule_action(self.name, self.engine_name, 'RequestHeader', index, fd_name, fd_group)
-                    index-=1
-            if response:
-                index = len(request)
-                if index: index-=1
-                while index >=0:
-                    print(f'removing rule ResponseHeader action index {index}.....')
-                    result = self.remove_rule_action(self.name, self.engine_name, 'ResponseHeader', index, fd_name, fd_group)
-                    index-=1
-
-            # REMOVE ALL CONDITIONS (there is not a NOOP condition since rules with no conditions is allowed by Azure) ....
-            result = self.get_all_rule_conditions(self.name, self.engine_name, fd_name, fd_group)
-            if result:
-                index = len(result)
-                if index: index-=1
-                while index >=0:
-                    print(f'removing rule condition index {index}.....')
-                    result = self.remove_rule_condition(self.name, self.engine_name, index, fd_name, fd_group)
-                    index-=1
-
-        if 'conditions' in cfg:
+        if 'conditions' in cfg and cfg['conditions']:
             for c in cfg['conditions']:
-                self.conditions.append(Condition.Condition(c, self.engine_name, self.name, fd_name, fd_group))
-        if 'actions' in cfg:
+                _condition = Condition.Condition(c, self.engine_name, self.name, fd_name, fd_group)
+                if _condition.has_conditions:
+                    self.conditions.append(_condition)
+        if 'actions' in cfg and cfg['actions']:
             for a in cfg['actions']:
                 self.actions.append(Action.Action(a, self.engine_name, self.name, fd_name, fd_group))
 
@@ -211,3 +98,110 @@ class Rule(object):
 
         #print(f'    --- RULE {" ".join(self.command)}\n')
 
+    def desired(self):
+        """
+        :return: the rule as it appears in the live rules engine, including the noop action
+        """
+        request = [self.noop_action]
+        response = []
+        override = None
+        for a in self.actions:
+            if a.action_type == 'RequestHeader':
+                request.append(a.desired())
+            elif a.action_type == 'ResponseHeader':
+                response.append(a.desired())
+            else:
+                override = a.desired()
+
+        return {
+            'priority': self.priority,
+            'action': {
+                'requestHeaderActions': request,
+                'responseHeaderActions': response,
+                'routeConfigurationOverride': override
+            },
+            'matchConditions': [c.desired() for c in self.conditions]
+        }
+
+    def compile(self):
+        """
+        :return: the rule as arm json for a whole rules engine PUT
+        """
+        _compiled = {'name': self.name}
+        _compiled.update(self.desired())
+        for a in self.actions:
+            if a.action_type == 'ForwardRouteOverride' or a.action_type == 'RedirectRouteOverride':
+                _compiled['action']['routeConfigurationOverride'] = a.compile()
+        _compiled['matchProcessingBehavior'] = 'Continue'
+        return _compiled
+
+    def changed(self):
+        """
+        :return: True|False if the compiled rule differs from the live rule
+        """
+        if not self.live:
+            return True
+        return util.differs(self.compile(), self.live)
+
+    def override(self):
+        """
+        :return: the configured route override Action, None without one. The last one wins, like in the live rule.
+        """
+        overrides = [a for a in self.actions if a.action_type in ['ForwardRouteOverride', 'RedirectRouteOverride']]
+        return overrides[-1] if overrides else None
+
+    def override_replaced(self):
+        """
+        :return: True|False if the live rule has a route override that differs from the config, which the cli
+        can not change in place
+        """
+        live_override = ((self.live or {}).get('action') or {}).get('routeConfigurationOverride')
+        override = self.override()
+        return bool(live_override) and bool(override) and util.differs(override.desired(), live_override)
+
+    def pools(self):
+        """
+        :return: names of the backend pools the route override actions forward to
+        """
+        return [a.backend_pool for a in self.actions if a.action_type == 'ForwardRouteOverride']
+
+    def reconcile(self):
+        """
+        :return: list of (create|delete, label, command, Action|Condition|None) turning the live rule into the config.
+        Actions and conditions do not have names or other identifiers, they are removed by index, the order they were
+        created in, which is also the order the lookup returns them in. RequestHeader index 0 is the noop action and is
+        never touched. A rule that matches the config needs no writes.
+        """
+        live = self.live or {}
+        live_action = live.get('action') or {}
+        request = [a for a in self.actions if a.action_type == 'RequestHeader']
+        response = [a for a in self.actions if a.action_type == 'ResponseHeader']
+        override = self.override()
+
+        removals = []
+        additions = []
+
+        live_override = live_action.get('routeConfigurationOverride')
+        if util.differs(override.desired() if override else None, live_override):
+            if live_override:
+                _type = 'ForwardRouteOverride' if 'backendPool' in live_override else 'RedirectRouteOverride'
+                removals.append(('delete', _type, self.remove_rule_action(self.name, self.engine_name, _type, 99, self.fd_name, self.fd_group), None))
+            if override:
+                additions.append(('create', override.action_type, override.command, override))
+
+        for _type, desired, slots, offset in [('RequestHeader', request, (live_action.get('requestHeaderActions') or [])[1:], 1),
+                                              ('ResponseHeader', response, live_action.get('responseHeaderActions') or [], 0)]:
+            remove, append = self.diff_slots([a.desired() for a in desired], slots)
+            for index in remove:
+                removals.append(('delete', f'{_type}[{index + offset}]',
+                                 self.remove_rule_action(self.name, self.engine_name, _type, index + offset, self.fd_name, self.fd_group), None))
+            for index in append:
+                additions.append(('create', f'{_type}[{index + offset}]', desired[index].command, desired[index]))
+
+        remove, append = self.diff_slots([c.desired() for c in self.conditions], live.get('matchConditions') or [])
+        for index in remove:
+            removals.append(('delete', f'condition[{index}]', self.remove_rule_condition(self.name, self.engine_name, index, self.fd_name, self.fd_group), None))
+        for index in append:
+            additions.append(('create', f'condition[{index}]', self.conditions[index].command, self.conditions[index]))
+
+        return removals + additions
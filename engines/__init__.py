@@ -1,8 +1,9 @@
 from . import Rule
-import subprocess
+import copy
 import traceback
 import json
 
+from routes import Utility as util
 from routes.Utility import assert_command_succeeded
 
 class Engine(object):
@@ -12,43 +13,19 @@ class Engine(object):
     '''
 
     @classmethod
-    def get_engine_rule(cls, engine, rule, fd_name, fd_group):
-        """
-        :return: string rule for given rule engine
-        """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'show', '--name', rule, '--rules-engine-name', engine, '-f', fd_name, '-g', fd_group], capture_output=True)
-
-        if result.stderr:
-            _errstr = result.stderr.decode("utf-8").replace("'", "")
-            if f'rule {rule} not found' in _errstr:
-                return {}
-
-        return json.loads(result.stdout)
-
-
-    @classmethod
-    def get_all_engine_rules(cls, engine, fd_name, fd_group):
+    def get_all_engine_rules(cls, engine, state):
         """
         :return: dict all rule name and priority in a given engine
         """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'rules-engine', 'rule', 'list', '--name', engine,
-             '-f', fd_name, '-g', fd_group, '--query', '[].{name:name,priority:priority}', '-o', 'json'], capture_output=True)
-
-        if result.stderr:
-            print(f'warning: {result.stderr.decode("utf-8")}')
-            return {}
-
         existing_rules = {}
 
-        for r in json.loads(result.stdout):
-            existing_rules[r['name']] = r['priority']
+        for k, r in state.engine_rules(engine).items():
+            existing_rules[k] = r['priority']
 
         return existing_rules
 
 
-    def __init__(self, cfg: dict, name: str, fd_name: str, fd_group: str):
+    def __init__(self, cfg: dict, name: str, fd_name: str, fd_group: str, state):
         if not cfg:
             raise ValueError('cfg cannot be None')
 
@@ -56,10 +33,12 @@ class Engine(object):
             raise TypeError('engine config rules cannot be empty')
 
         self.name = name
+        self.id = f'{state.id}/rulesEngines/{name}'
+        self.live = state.engine(name)
         self.rules = []
         next_priority = 0
 
-        existing_rules = self.get_all_engine_rules(self.name, fd_name, fd_group)
+        existing_rules = self.get_all_engine_rules(self.name, state)
 
         if existing_rules:
             for k,v in existing_rules.items():
@@ -68,10 +47,10 @@ class Engine(object):
         noop_rule = {'routemanagerNOOP': None}
 
         if 'routemanagerNOOP' in existing_rules:
-            self.rules.append(Rule.Rule('update', noop_rule, name, existing_rules['routemanagerNOOP'], fd_name, fd_group))
+            self.rules.append(Rule.Rule('update', noop_rule, name, existing_rules['routemanagerNOOP'], fd_name, fd_group, state))
         else:
             next_priority+=1
-            self.rules.append(Rule.Rule('create', noop_rule, name, next_priority, fd_name, fd_group))
+            self.rules.append(Rule.Rule('create', noop_rule, name, next_priority, fd_name, fd_group, state))
 
         '''
         Azure api does no allow you to remove the rule from an engine if it is the only rule.
@@ -84,8 +63,39 @@ class Engine(object):
         for r in cfg['rules']:
             _rule = next(iter(r))
             if _rule in existing_rules:
-                self.rules.append(Rule.Rule('update', r, name, existing_rules[_rule], fd_name, fd_group))
+                self.rules.append(Rule.Rule('update', r, name, existing_rules[_rule], fd_name, fd_group, state))
             else:
                 next_priority+=1
-                self.rules.append(Rule.Rule('create', r, name, next_priority, fd_name, fd_group))
+                self.rules.append(Rule.Rule('create', r, name, next_priority, fd_name, fd_group, state))
 
+    def compile(self, rules: list = None):
+        """
+        :param rules: the configured rules to splice into the live rules, all of them by default
+        :return: the whole rules engine as arm json, every configured rule including routemanagerNOOP with its
+        priority, conditions and actions. Live rules that are not in the config are kept as they are.
+        """
+        _rules = self.rules if rules is None else rules
+        rules = copy.deepcopy((self.live or {}).get('rules') or [])
+        for r in _rules:
+            compiled = r.compile()
+            for index, existing in enumerate(rules):
+                if existing['name'].lower() == r.name.lower():
+                    rules[index] = compiled
+                    break
+            else:
+                rules.append(compiled)
+        return {'name': self.name, 'properties': {'rules': rules}}
+
+    def changed(self):
+        """
+        :return: True|False if the compiled engine differs from the live engine
+        """
+        if not self.live:
+            return True
+        return util.differs(self.compile()['properties']['rules'], self.live.get('rules'))
+
+    def pools(self):
+        """
+        :return: names of the backend pools the route override actions forward to
+        """
+        return [p for r in self.rules for p in r.pools()]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+'''
+This tool applies many route manager configs across many front doors
+
+The input is one or more config directories or glob patterns. Configs are grouped by front-door-name and
+front-door-group, different front doors run in parallel worker processes and the configs of one front door
+run one after another, in path order, so writes to a single front door are never concurrent.
+Any other argument is passed to frontdoor_route_manager.py for every config.
+'''
+import os
+import sys
+import glob
+import argparse
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from routes import ConfigCache
+
+TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontdoor_route_manager.py')
+
+
+def discover(patterns: list):
+    """
+    :return: sorted config paths, a directory means every .cfg file in it
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.cfg')
+        paths.update(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return sorted(paths)
+
+
+def group(paths: list, cache):
+    """
+    :return: ({(front door name, group): [paths]}, {path: error}) for configs that could not be read
+    """
+    groups = {}
+    invalid = {}
+    for path in paths:
+        try:
+            with open(path) as file:
+                config = cache.load(file)
+            key = (str(config['front-door-name']).lower(), str(config['front-door-group']).lower())
+            groups.setdefault(key, []).append(path)
+        except Exception as e:
+            invalid[path] = ' '.join(str(e).split())
+    return groups, invalid
+
+
+def apply_front_door(paths: list, passthrough: list, results: dict, lock):
+    ''' run the configs of one front door in order, each as its own route manager process '''
+    for path in paths:
+        started = time.time()
+        _exec = subprocess.run([sys.executable, TOOL, '--config', path] + passthrough, universal_newlines=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with lock:
+            results[path] = (_exec.returncode, time.time() - started)
+            print(f'\n===== {path} (exit {_exec.returncode}) =====')
+            print(_exec.stdout, end='')
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='any other argument is passed to frontdoor_route_manager.py')
+  parser.add_argument(
+    'configs',
+    nargs='+',
+    help="config directories or glob patterns, quote globs so the tool expands them")
+
+  parser.add_argument(
+    '--workers',
+    help="number of front doors to apply at once (default 4)",
+    type=int,
+    default=4)
+
+  _args, passthrough = parser.parse_known_args()
+  _args = vars(_args)
+
+  paths = discover(_args['configs'])
+  if not paths:
+      print(f'no configs found in {" ".join(_args["configs"])}, clean exit')
+      sys.exit(0)
+
+  groups, invalid = group(paths, ConfigCache.ConfigCache(enabled=not '--no-cache' in passthrough))
+  print(f'{len(paths)} configs for {len(groups)} front doors, {len(invalid)} invalid')
+
+  results = {}
+  lock = threading.Lock()
+  with ThreadPoolExecutor(max_workers=max(1, _args['workers'])) as pool:
+      futures = [pool.submit(apply_front_door, group_paths, passthrough, results, lock) for group_paths in groups.values()]
+      for future in futures:
+          future.result()
+
+  print('\nfleet results:')
+  status = 0
+  for (fd_name, fd_group), group_paths in sorted(groups.items()):
+      for path in group_paths:
+          returncode, elapsed = results[path]
+          print(f'  {"ok    " if returncode == 0 else "FAILED"} {fd_group}/{fd_name} {path} (exit {returncode}, {elapsed:.1f}s)')
+          if returncode != 0: status = 1
+  for path, error in sorted(invalid.items()):
+      print(f'  INVALID {path}: {error}')
+      status = 1
+
+  sys.exit(status)
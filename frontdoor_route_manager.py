@@ -7,48 +7,24 @@ See /env/FrontdoorRouteManagerExample.cfg for details
 '''
 import os
 import sys
-import yaml
+import json
+import time
+import atexit
 import argparse
 from engines import Engine
-from routes import Frontend, Pool, Rule
+from routes import AzWorker, CertWatcher, ConfigCache, Dns, Document, Executor, Frontend, LookupCache, Normalize, Plan, Pool, Rule, State, Throttle, Trace
 from routes import Utility as util
 
 class EngineAssociation(object):
-    def __init__(self, rule: str, engine: str, fd_name: str, fd_group: str):
-        ''' link a rule engine to a rule '''
+    def __init__(self, links: dict, fd_id: str, fd_name: str, fd_group: str):
+        ''' link rules engines to routing rules, every link in one front door update '''
         self.command = ['az', 'network', 'front-door']
-        self.command.extend(['routing-rule', 'update'])
-        self.command.extend(['--front-door-name', fd_name])
+        self.command.extend(['update'])
+        self.command.extend(['--name', fd_name])
         self.command.extend(['--resource-group', fd_group])
-        self.command.extend(['--name', rule])
-        self.command.extend(['--rules-engine', engine])
-
-class Backend(object):
-    def __init__(self, pool: str, endpoint: dict, fd_name: str, fd_group: str):
-        ''' endpoint param was updated to dictionary 02/02/2021 '''
-        self.action = 'add'
-        self.command = ['az', 'network', 'front-door']
-        self.command.extend(['backend-pool', 'backend', self.action])
-        self.command.extend(['--front-door-name', fd_name])
-        self.command.extend(['--resource-group', fd_group])
-        self.command.extend(['--pool-name', pool])
-        self.command.extend(['--address', next(iter(endpoint))])
-        if 'host-header' in endpoint and endpoint['host-header']:
-            self.command.extend(['--backend-host-header', endpoint['host-header']])
-
-class BackendRemove(object):
-    '''
-    TBD..  this won't work because we need to know the index of the backend and it;s not available in portal or show command.
-    This is a BUG in frontdoor api
-    so we have no choice but to remove duplicate backends if found because we cannot remove the pool since rule engines and rules are associated.
-    '''
-    def __init__(self, pool, endpoint, fd_name, fd_group):
-        self.action = 'remove'
-        self.command = ['az', 'network', 'front-door']
-        self.command.extend(['backend-pool', 'backend', self.action])
-        self.command.extend(['--front-door-name', fd_name])
-        self.command.extend(['--resource-group', fd_group])
-        self.command.extend(['--pool-name', pool])
+        self.command.extend(['--set'])
+        for rule, engine in links.items():
+            self.command.extend([f'routingRules[name={rule}].rulesEngine={json.dumps({"id": f"{fd_id}/rulesEngines/{engine}"})}'])
 
 class Route(object):
     '''
@@ -56,9 +32,10 @@ class Route(object):
     may or may not override these depending on the Action in each rule in each engine config.
     ref: https://docs.microsoft.com/en-us/azure/frontdoor/front-door-rules-engine
     '''
-    def __init__(self, cfg, fd_name, fd_group):
+    def __init__(self, cfg, fd_name, fd_group, state, registry=None):
         if not cfg:
             raise ValueError('cfg cannot be None')
+        registry = registry or Normalize.Registry()
         self.frontends = []
         self.pool = None
         self.rule = None
@@ -75,10 +52,12 @@ class Route(object):
                     fe_name = k
                     frontend_names.append(k)
                 break
-            self.frontends.append(Frontend.Frontend(frontend_cfg, fe_name, fd_name, fd_group))
+            # routes sharing a frontend share one instance, its dns, cname and key vault steps run once
+            self.frontends.append(registry.get('frontend', frontend_cfg,
+                                               lambda: Frontend.Frontend(frontend_cfg, fe_name, fd_name, fd_group, state)))
 
         if 'backend-pool' in cfg and cfg['backend-pool']:
-            self.pool = Pool.Pool(cfg['backend-pool'], fd_name, fd_group)
+            self.pool = registry.get('pool', cfg['backend-pool'], lambda: Pool.Pool(cfg['backend-pool'], fd_name, fd_group, state, registry))
 
         _rulename = None
         if isinstance(cfg, dict):
@@ -91,6 +70,397 @@ class Route(object):
             self.rule = Rule.Rule(cfg, _rulename, frontend_names, None, fd_name, fd_group)
 
 
+def record_planned_frontends(state, route):
+    ''' later routes may reference a frontend this run creates as existing, let them resolve it from the plan '''
+    for frontend in route.frontends:
+        if frontend.create_frontend and not state.frontend(frontend.name):
+            state.record('frontendEndpoints', {'name': frontend.name, 'hostName': frontend.hostname})
+
+
+def check_cname(frontend):
+    '''
+    the dns check the preflight left out for a frontend whose cname this run creates, run once the cname exists and
+    before cert provisioning is submitted. A front door managed cert on an unmapped host name can get stuck in domain
+    validation, so the run stops here as the preflight would have.
+    :return: (True, target) when the host name maps to the front door
+    '''
+    targets, error = Dns.get().wait_cname(frontend.hostname, frontend.cname_target())
+    if not frontend.cname_target() in targets:
+        raise Exception(f'DNS is not valid for {frontend.name}: {frontend.hostname} mapped to {", ".join(targets) or "nothing"}, '
+                        f'expected {frontend.cname_target()}' + (f', {error}' if error else ''))
+    return True, frontend.cname_target()
+
+
+def plan_frontend_access(plan, route, read_vaults=True):
+    '''
+    add the dns cname a new frontend needs before it is created and the key vault access its certificate needs
+    before cert provisioning. The vault policy is read while planning and only written when the front door
+    principal is missing get access, a failed grant does not stop the run. Without read_vaults the vault
+    access is not planned.
+    '''
+    for frontend in route.frontends:
+        if frontend.cname_command and not plan.state.frontend(frontend.name):
+            _check = (lambda f=frontend: check_cname(f)) if frontend.cname_target() else None
+            plan.add(Plan.Operation('create', 'dns cname', frontend.hostname, frontend.cname_command, route.fatal, wait=_check))
+        if frontend.vault_name and not read_vaults:
+            print(f'key vault access to {frontend.vault_name} not checked, planning from a state file')
+        elif frontend.vault_name and not plan.find('key vault access', frontend.vault_name):
+            # the service principal for front door may differ from subscription to subscription
+            fd_sp_object_id = Frontend.Frontend.get_front_door_sp()['objectId']
+            if Frontend.Frontend.vault_access_needed(frontend.vault_name, fd_sp_object_id):
+                plan.add(Plan.Operation('update', 'key vault access', frontend.vault_name,
+                                        Frontend.Frontend.vault_access_command(frontend.vault_name, fd_sp_object_id), False, ['accessPolicies']))
+            else:
+                print(f'front door service principal already has get access to key vault {frontend.vault_name}')
+
+
+def plan_https(plan, route, watcher, after=None):
+    '''
+    add cert provisioning for the route frontends whose live https config differs. The enable-https
+    command returns once it is accepted, the watcher tracks provisioning without holding up the run.
+    '''
+    for frontend in route.frontends:
+        if frontend.enable_ssl:
+            if frontend.https_needed(plan.state):
+                _watch = lambda name=frontend.name: watcher.watch(name)
+                _after = (after or []) + [plan.find('frontend', frontend.name), plan.find('key vault access', frontend.vault_name)]
+                plan.add(Plan.Operation('update', 'cert provisioning', frontend.name, frontend.ssl_command, route.fatal, ['customHttpsConfiguration'],
+                                        after=_after, on_success=_watch))
+            else:
+                print(f'cert provisioning for {frontend.name} not needed, current config is good!')
+
+
+def plan_frontends(plan, route, watcher):
+    ''' add the frontend creates and cert provisioning for one route, these are planned for every route up front '''
+    state = plan.state
+
+    # PROCESS FRONTENDS
+    for frontend in route.frontends:
+        if frontend.create_frontend and not state.frontend(frontend.name):
+            plan.add(Plan.Operation('create', 'frontend', frontend.name, frontend.command, route.fatal, record='frontendEndpoints',
+                                    after=[plan.find('dns cname', frontend.hostname)]))
+    record_planned_frontends(state, route)
+    plan_https(plan, route, watcher)
+
+
+def plan_route(plan, route, fd_name, fd_group):
+    '''
+    add the remaining writes needed for one route. Each write only waits on the writes it depends on:
+    frontends before the rule, probe and load balancing before the pool, the pool before its backend list
+    update and the rule.
+    '''
+    state = plan.state
+    frontend_ops = [plan.find('frontend', frontend.name) for frontend in route.frontends]
+
+    # PROCESS BACKEND POOL
+    pool_op = None
+    if route.pool and route.pool.create_pool:
+        probe_op = None
+        probe = route.pool.probe
+        if probe and probe.action:
+            probe_op = plan.reconcile('probe', probe.name, probe.desired(), state.probe(probe.name), probe.command, route.fatal, 'healthProbeSettings')
+
+        loadbalancing_op = None
+        loadbalancing = route.pool.loadbalancing
+        if loadbalancing and loadbalancing.action:
+            loadbalancing_op = plan.reconcile('load balancing', loadbalancing.name, loadbalancing.desired(), state.loadbalancing(loadbalancing.name),
+                                              loadbalancing.command, route.fatal, 'loadBalancingSettings')
+
+        _live_pool = state.pool(route.pool.name)
+        if route.pool.action:
+            pool_op = plan.add(Plan.Operation('create', 'pool', route.pool.name, route.pool.command, route.fatal, record='backendPools',
+                                              after=[probe_op, loadbalancing_op]))
+            _live_pool = route.pool.created()
+
+        # the complete backend list in one update, backends no longer in the config are dropped
+        changes = util.changed_fields(route.pool.desired(), _live_pool)
+        if changes:
+            pool_op = plan.add(Plan.Operation('update', 'pool backends', route.pool.name, route.pool.update_command, route.fatal, changes,
+                                              'backendPools', after=[pool_op, probe_op, loadbalancing_op]))
+    elif route.pool:
+        print(f'Using existing backend pool {route.pool.name}.....')
+        pool_op = plan.find('pool', route.pool.name)
+
+    # PROCESS RULE
+    if route.rule.ruletype and route.rule.action:
+        plan.reconcile('routing rule', route.rule.name, route.rule.desired(), state.routing_rule(route.rule.name),
+                       route.rule.command, route.fatal, 'routingRules', after=frontend_ops + [pool_op])
+
+
+def plan_engine(plan, engine):
+    '''
+    compile the whole rules engine, every rule with its priority, conditions and actions, and write it with a
+    single PUT when it differs from the live engine. Waits on the backend pools its route overrides forward to.
+    :return: the engine Operation, None if the engine is unchanged
+    '''
+    if not engine.changed():
+        return None
+    body = Document.Document.expand(engine.compile(), plan.state.id)
+    return plan.add(Plan.Operation('update' if engine.live else 'create', 'rules engine', engine.name, Document.Document.put(engine.id),
+                                   changes=['rules'] if engine.live else [], record='rulesEngines',
+                                   after=[plan.find('pool', p) for p in engine.pools()], body=body))
+
+
+def plan_engine_rules(plan, engine):
+    '''
+    add the rules engine az commands for one engine, unchanged rules and unchanged action and condition slots produce
+    no operation. Every write of one engine runs in order, the actions and conditions are positional,
+    and a route override action waits on its backend pool when this plan creates it.
+    A rule whose live route override has to change is written whole with one PUT of the engine instead, carrying the
+    rules changed before it in this pass, as the cli can only remove the override and add it again.
+    :return: the last Operation of the engine, None if the engine is unchanged
+    '''
+    last = None
+    written = []
+    for r in engine.rules:
+        _name = f'{engine.name}/{r.name}'
+        if r.changed():
+            written.append(r)
+        if r.override_replaced():
+            body = Document.Document.expand(engine.compile(written), plan.state.id)
+            last = plan.add(Plan.Operation('update', 'engine rule', _name, Document.Document.put(engine.id), changes=['routeConfigurationOverride'],
+                                           record='rulesEngines', after=[last] + [plan.find('pool', p) for p in r.pools()], body=body))
+            continue
+
+        if not r.live:
+            last = plan.add(Plan.Operation('create', 'engine rule', _name, r.command, after=[last]))
+        elif r.live.get('priority') != r.priority:
+            last = plan.add(Plan.Operation('update', 'engine rule', _name, r.command, changes=['priority'], after=[last]))
+
+        for action, label, command, item in r.reconcile():
+            if action == 'delete':
+                last = plan.add(Plan.Operation('delete', 'engine rule item', f'{_name} {label}', command, after=[last]))
+                continue
+            if label.startswith('condition'):
+                last = plan.add(Plan.Operation('create', 'engine rule condition', f'{_name} {label}', command, after=[last]))
+                continue
+            _pool = plan.find('pool', item.backend_pool) if item.action_type == 'ForwardRouteOverride' else None
+            last = plan.add(Plan.Operation('create', 'engine rule action', f'{_name} {label}', command, after=[last, _pool]))
+    return last
+
+
+def plan_associations(plan, links: dict, fd_name, fd_group, engine_ops: dict):
+    '''
+    link rules engines to routing rules with a single front door update. A rule is skipped when the front door
+    lookup already shows it linked to its engine and this plan does not rewrite the routing rule.
+    The update reads and writes the whole front door, so it runs after every other write of the plan.
+    :return: the association Operation, None if every rule is already linked
+    '''
+    _links = {}
+    for rule, engine in links.items():
+        live = plan.state.routing_rule(rule) or {}
+        if not util.differs({'id': engine}, live.get('rulesEngine')) and not plan.planned('routing rule', rule):
+            continue
+        _links[live.get('name') or rule] = engine
+    if not _links:
+        return None
+    engine_assoc = EngineAssociation(_links, plan.state.id, fd_name, fd_group)
+    return plan.add(Plan.Operation('update', 'engine association', fd_name, engine_assoc.command,
+                                   changes=[f'{r}/{e}' for r, e in _links.items()],
+                                   after=list(plan.operations) + [engine_ops.get(e.lower()) for e in _links.values()]))
+
+
+def reconcile(config: dict, _args: dict, live: dict = None):
+    '''
+    build the models from the compiled config, plan the writes against the live front door and apply them.
+    live is the front door document when the caller already fetched it, otherwise it is looked up here.
+    :return: 0 on success, 1 if a non fatal step such as cert provisioning did not complete
+    '''
+    script_error_status = 0
+
+    rule_list = config['routing-rules']
+
+    frontdoor_name = config['front-door-name']
+    frontdoor_group = config['front-door-group']
+
+    # one bulk lookup of the live front door, every model below resolves existing resources from this snapshot
+    print(f'\n{"validate config for" if _args["validate"] else "get"} front door {frontdoor_name} state......')
+    # vault access is planned from a fresh read on every pass of a watch
+    Frontend.Frontend.reset()
+    document = None
+    offline = _args['validate']
+    # planning from an exported snapshot, nothing may be read from azure either
+    from_snapshot = bool(_args['state_file'])
+    with Trace.span('front door lookup', phase='state', kind='front door', resource=frontdoor_name):
+        snapshot = live
+        if from_snapshot:
+            with open(_args['state_file']) as f:
+                snapshot = json.load(f)
+            if str(snapshot.get('name')).lower() != str(frontdoor_name).lower() or not f'/resourcegroups/{frontdoor_group}/'.lower() in str(snapshot.get('id')).lower():
+                raise ValueError(f'{_args["state_file"]} holds front door {snapshot.get("id")}, not {frontdoor_name} in {frontdoor_group}')
+        if offline:
+            state = State.State.empty(frontdoor_name, frontdoor_group)
+        elif _args['apply_mode'] == 'document':
+            document = Document.Document(frontdoor_name, frontdoor_group, snapshot)
+            state = State.State(frontdoor_name, frontdoor_group, document.current)
+        elif snapshot:
+            state = State.State(frontdoor_name, frontdoor_group, snapshot)
+        else:
+            state = State.State.load(frontdoor_name, frontdoor_group)
+
+    plan = Plan.Plan(state)
+    routes = []
+
+    # A timeout of 3600 matches the front door designer UI which states that certificate provisioning
+    # can take an hour. Another hour is added to account for the domain validation step when using
+    # Front Door managed certificates.
+    watcher = CertWatcher.CertWatcher(frontdoor_name, frontdoor_group, 7200)
+    engine_ops = {}
+
+    # every front door managed cert host name is resolved up front, concurrently, and all failures are
+    # reported together before any resource is built
+    dns_checks = [] if offline or from_snapshot else Frontend.Frontend.dns_checks(rule_list, frontdoor_name, state)
+    if dns_checks:
+        print(f'\nvalidate DNS for {len(dns_checks)} front door managed cert frontends......')
+        with Trace.span('dns preflight', phase='frontend', kind='dns'):
+            dns_failures = Dns.get().preflight(dns_checks, max(16, _args['parallelism']))
+        if dns_failures:
+            for failure in dns_failures:
+                print(f'  {failure}')
+            raise Exception(f'DNS is not valid for {len(dns_failures)} frontends')
+
+    print('\nprocess routes......')
+
+    # every distinct frontend, pool, probe and load balancing is built once
+    registry = Normalize.Registry()
+    for route_cfg in rule_list:
+        with Trace.span('build route', phase='frontend', kind='route', resource=next(iter(route_cfg))):
+            route = Route(route_cfg, frontdoor_name, frontdoor_group, state, registry)
+        print(f'\nROUTE RULE NAME --- {route.rule.name}')
+        routes.append(route)
+        if offline:
+            continue
+        # models only validate and resolve state, every write is a plan operation run in the apply phase
+        plan_frontend_access(plan, route, not from_snapshot)
+        if document:
+            document.add_route(route)
+            record_planned_frontends(state, route)
+        else:
+            plan_frontends(plan, route, watcher)
+
+    # enable-https for every frontend is planned ahead of the pools and rules so it is submitted first
+    if not document and not offline:
+        for route in routes:
+            plan_route(plan, route, frontdoor_name, frontdoor_group)
+
+    # RULES ENGINE CONFIG
+    print('\nprocess rules engines.....')
+
+    engine_list = config['engine-rules']
+
+    for engine_cfg in engine_list:
+        _engine_name = next(iter(engine_cfg))
+        print(f'get Engine instance {next(iter(engine_cfg))}')
+        with Trace.span('build engine', phase='engine', kind='rules engine', resource=_engine_name):
+            engine = Engine(engine_cfg, _engine_name, frontdoor_name, frontdoor_group, state)
+        print(f'engine {engine.name} rules\n{[r.name for r in engine.rules]}')
+        if offline:
+            continue
+        if document:
+            document.add_engine(engine)
+        else:
+            _plan_engine = plan_engine if _args['engine_apply'] == 'engine' else plan_engine_rules
+            engine_ops[engine.name.lower()] = _plan_engine(plan, engine)
+
+    # LINK RULES ENGINE CONFIG
+    print('\nassociating rules to engines.....')
+
+    link_list = [] if offline else config['engine-associations']
+
+    links = {}
+    for link_cfg in link_list:
+        engine_name = next(iter(link_cfg))
+        print(f'Engine Association for engine: {engine_name}')
+        for r in link_cfg[engine_name]:
+            if document:
+                document.associate(r, engine_name)
+            else:
+                links[r] = engine_name
+    if links:
+        plan_associations(plan, links, frontdoor_name, frontdoor_group, engine_ops)
+
+    if document:
+        # the whole front door goes out in one PUT, cert provisioning needs the frontends to exist first
+        document_op = document.plan(plan)
+        if document_op:
+            document_op.after.extend(op for op in plan.operations if op.kind == 'dns cname')
+        for route in routes:
+            plan_https(plan, route, watcher, [document_op])
+
+    if offline:
+        print(f'\nconfig for front door {frontdoor_name} is valid: {len(routes)} routes, {len(engine_list)} rules engines')
+        return 0
+
+    print(f'\nplan for front door {frontdoor_name}:')
+    plan.show(_args['verbose'])
+
+    if not _args["whatif"] and not _args["plan"]:
+        script_error_status = plan.execute(_args['verbose'], _args['veryverbose'], _args['parallelism'])
+
+        for name, (result, status) in watcher.results().items():
+            if result:
+                print(f'\n*** cert provisioning for frontend {name} succeeded with status {status} ***\n')
+            else:
+                print(f'\n*** CERT PROVISIONING FOR FRONTEND {name} FAILED with status {status} ***\n')
+                script_error_status = 1
+
+    return script_error_status
+
+
+def watch(path: str, _args: dict):
+    '''
+    reconcile the front door whenever it or the config changes, until interrupted. Every interval seconds the
+    front door is read with a conditional GET (a 304 while its etag is unchanged, see the lookup cache) and the
+    config file is checked by mtime and size, it is only read again when those moved and only parsed again
+    when its content changed. A pass runs the full compare only when the front door version (its etag, or a
+    fingerprint of the document when it has none) or the compiled config changed, or the last pass failed,
+    and writes only what drifted. No pass runs while the front door is still provisioning an update.
+    '''
+    cache = ConfigCache.ConfigCache(enabled=not _args['no_cache'])
+    config = None
+    stamp = None
+    version = None
+    retry = False
+    passes = 0
+    while True:
+        try:
+            _stat = os.stat(path)
+            changed = False
+            if (_stat.st_mtime_ns, _stat.st_size) != stamp:
+                with open(path) as file:
+                    _config = cache.load(file)
+                changed = _config != config
+                config = _config
+                stamp = (_stat.st_mtime_ns, _stat.st_size)
+
+            with Trace.span('front door poll', phase='state', kind='front door', resource=config['front-door-name']):
+                live = Document.Document.fetch(config['front-door-name'], config['front-door-group'])
+            provisioning = (live.get('properties') or {}).get('provisioningState')
+            if provisioning in ['Updating', 'Creating', 'Deleting']:
+                print(f'front door {config["front-door-name"]} is {provisioning}, waiting')
+            elif changed or retry or Document.Document.version(live) != version:
+                _reason = 'first pass' if not passes else 'config changed' if changed else 'retry' if retry else 'front door changed'
+                passes += 1
+                retry = False
+                print(f'\n===== watch pass {passes}: {_reason} =====')
+                if reconcile(config, _args, live) != 0:
+                    # a step did not complete, compare again on the next poll
+                    retry = True
+                else:
+                    # the writes of this pass moved the version, read it again so they do not set off another compare,
+                    # a pass without writes gets a 304 here
+                    version = Document.Document.version(Document.Document.fetch(config['front-door-name'], config['front-door-group']))
+        except KeyboardInterrupt:
+            return 0
+        except Exception as e:
+            print(f'watch pass failed, retrying in {_args["interval"]}s: {str(e)}')
+            retry = True
+        try:
+            time.sleep(_args['interval'])
+        except KeyboardInterrupt:
+            return 0
+
+
 if __name__ == "__main__":
 
   parser = argparse.ArgumentParser()
@@ -112,254 +482,131 @@ if __name__ == "__main__":
 
   parser.add_argument(
     '--whatif',
-    help="do not process anything",
+    help="show the plan without writing anything, the live front door, key vault policies and dns are only read",
     action='store_true')
 
-  _args = vars(parser.parse_args())
-
-  if not os.path.isfile(_args['config']):
-      print(f'config {_args["config"]} not found, clean exit')
-      sys.exit(0)
+  parser.add_argument(
+    '--validate',
+    help="only validate the config, offline: nothing is read from or written to azure",
+    action='store_true')
 
-  script_error_status = 0
+  parser.add_argument(
+    '--export-state',
+    help="write the live front door document, rules engines included, to this json file and exit",
+    metavar='FILE')
 
-  with open(_args['config']) as file:
-    config = yaml.load(file, Loader=yaml.FullLoader)
+  parser.add_argument(
+    '--plan',
+    help="show the plan without writing anything, like --whatif, required with --state-file",
+    action='store_true')
 
-    rule_list = config['routing-rules']
-    
-    if not 'front-door-name' in config:
-        raise TypeError('missing frontdoor name config')
+  parser.add_argument(
+    '--state-file',
+    help="plan against a front door document written by --export-state instead of the live front door, nothing is read from azure",
+    metavar='FILE')
 
-    if not 'front-door-group' in config:
-        raise TypeError('missing frontdoor group config')
+  parser.add_argument(
+    '--watch',
+    help="keep running, reapply what drifted whenever the front door or the config changes",
+    action='store_true')
 
-    frontdoor_name = config['front-door-name']
-    frontdoor_group = config['front-door-group']
+  parser.add_argument(
+    '--interval',
+    help="seconds between --watch polls (default 60)",
+    type=int,
+    default=60)
 
-    print('\nprocess routes......')
+  parser.add_argument(
+    '--apply-mode',
+    help="commands: one az command per changed resource, document: compile the whole front door and apply it with one PUT",
+    choices=['commands', 'document'],
+    default='commands')
 
-    found = []
-    rule_seq = []
-    for route in rule_list:
-        if not route in found:
-            found.append(route)
-            rule_seq.append(route)
-    for route_cfg in rule_seq:
-        route = Route(route_cfg, frontdoor_name, frontdoor_group)
+  parser.add_argument(
+    '--parallelism',
+    help="number of independent writes to run at once, writes to one rules engine or one pool always run in order (default 1)",
+    type=int,
+    default=1)
 
-        print(f'\nROUTE RULE NAME --- {route.rule.name}')
+  parser.add_argument(
+    '--engine-apply',
+    help="engine: compile each changed rules engine and write it with one PUT, rules: az commands for only the changed rules, actions and conditions, a PUT of the engine for a rule whose route override changes (commands apply mode)",
+    choices=['engine', 'rules'],
+    default='engine')
 
-        # PROCESS FRONTENDS
-        for frontend in route.frontends:
-            if frontend.create_frontend:
-                print(f'creating frontend {frontend.name}, please wait ........')
-                if _args['verbose']: print(f'\n{" ".join(frontend.command)}')
-                if not _args["whatif"]:
-                    success, result = util.execute(frontend.command)
-                    if not success or not result:
-                        print(f'command returned with:\n{result}')
-                        if not 'already exists' in result and route.fatal:
-                            raise RuntimeError(f'failed to create frontend {frontend.name}')
-                    if _args['veryverbose']: print(result)
-
-            if frontend.enable_ssl:
-                #Is cert provisioning needed? the cli is NOT idempotent when specifying custom certs.
-                #It will remove and recreate the cert on the frontend if we just call enable-ssl.
-                #So we check to see if the metadata is already what we want to it to be
-                _provision_cert = True
-
-                if frontend.is_custom_cert:
-                    newssl_config = {
-                        "secret_name": frontend.secret_name,
-                        "secret_version": None if 'Latest' == frontend.secret_version else frontend.secret_version,
-                        "minimum_tls": str(frontend.tls_version),
-                        "vault_id": frontend.vault_id
-                    }
-
-                    _provision_cert = util.provisioning_needed(
-                                          frontdoor_name,
-                                          frontdoor_group,
-                                          frontend.name,
-                                          newssl_config)
-
-                if _provision_cert:
-                    print(f'\nenabling ssl on {frontend.name}, please wait ......')
-                    if not _args["whatif"]:
-                        success, result = util.execute(frontend.ssl_command)
-                        if not success or not result:
-                            print(f'command returned with:\n{result}')
-                            if not 'already exists' in result and route.fatal:
-                                raise RuntimeError(f'failed to create frontend {frontend.name}')
-                        if _args['veryverbose']: print(result)
-
-                    # A timeout of 3600 matches the front door designer UI which states that certificate provisioning
-                    # can take an hour. Another hour is added to account for the domain validation step when using
-                    # Front Door managed certificates.
-                    result, status = util.cert_provisioning_status(frontdoor_name, frontdoor_group, frontend.name, 7200, 'Enabled')
-                    if result:
-                        print(f'\n*** cert provisioning for frontend {frontend.name} succeeded with status {status} ***\n')
-                    else:
-                        print(f'\n*** CERT PROVISIONING FOR FRONTEND {frontend.name} FAILED with status {status} ***\n')
-                        script_error_status = 1
-                else:
-                    print('cert provisioning not needed, current config is good!')
-
-        # PROCESS BACKEND POOL
-        if route.pool and route.pool.create_pool:
-            if _args['verbose'] and route.pool.probe.command:
-                print(f'\n{" ".join(route.pool.probe.command)}')
-            if route.pool.probe.action and not _args["whatif"]:
-                print(f'creating probe {route.pool.probe.name}, please wait ...')
-                success, result = util.execute(route.pool.probe.command)
-                if not success or not result:
-                    print(f'command returned with:\n{result}')
-                    if not 'already exists' in result and route.fatal:
-                        raise RuntimeError(f'failed to create probe {route.pool.probe.name}')
-                if _args['veryverbose']: print(result)
-
-            if route.pool.loadbalancing.action and not _args["whatif"]:
-                print(f'creating load balancing {route.pool.loadbalancing.name}, please wait ...')
-                success, result = util.execute(route.pool.loadbalancing.command)
-                if not success or not result:
-                    print(f'command returned with:\n{result}')
-                    if not 'already exists' in result and route.fatal:
-                        raise RuntimeError(f'failed to create loadbalancing {route.pool.loadbalancing.name}')
-                if _args['veryverbose']: print(result)
-
-            if _args['verbose'] and route.pool.command:
-                print(f'\n{" ".join(route.pool.command)}')
-
-            if not _args["whatif"]:
-                print(f'creating pool {route.pool.name}, please wait ...')
-                print(f'\ncmd: {" ".join(route.pool.command)}')
-                success, result = util.execute(route.pool.command, False, True)
-                if not success or not result:
-                    print(f'command returned with:\n{result}')
-                    if not 'already exists' in result and route.fatal:
-                        raise RuntimeError(f'failed to create pool {route.pool.name}')
-                if _args['veryverbose']: print(result)
-
-                #BACKEND PROCESSING
-                _command = ['az', 'network', 'front-door']
-                _command.extend(['backend-pool', 'show'])
-                _command.extend(['--front-door-name', frontdoor_name])
-                _command.extend(['--resource-group', frontdoor_group])
-                _command.extend(['--name', route.pool.name])
-
-                success, result = util.execute(_command)
-                _existing_backends = []
-
-                for be in result['backends']:
-                    _existing_backends.append(be['address'])
-                if _args['verbose']:
-                    print(f'existing backends: {_existing_backends}')
-
-                for endpoint in route.pool.backends:
-                    if not next(iter(endpoint)) in _existing_backends:
-                        print(f'adding backend {next(iter(endpoint))}')
-                        backend = Backend(route.pool.name, endpoint, frontdoor_name, frontdoor_group)
-                        if _args['verbose']: print(f'\n{" ".join(backend.command)}')
-                        if backend.action and not _args["whatif"]:
-                            print(f'creating pool backend {next(iter(endpoint))}, please wait ...')
-                            success, result = util.execute(backend.command)
-                            if not success or not result:
-                                print(f'command returned with:\n{result}')
-                                if not 'already exists' in result and route.fatal:
-                                    raise RuntimeError(f'failed to add backend {next(iter(endpoint))} to pool {route.pool.name}')
-                            if _args['veryverbose']: print(result)
+  parser.add_argument(
+    '--max-retries',
+    help="retries of a throttled azure call, after its Retry-After or with jittered exponential backoff (default 6)",
+    type=int,
+    default=6)
 
-        else:
-            if route.pool:
-                print(f'Using existing backend pool {route.pool.name}.....')
-
-        # PROCESS RULE
-        if route.rule.ruletype and route.rule.action and not _args["whatif"]:
-            print(f'debug: rule type? {route.rule.ruletype} action? {route.rule.action}')
-            print(f'creating rule {route.rule.name}, please wait .....')
-            if _args['verbose']: print(f'{" ".join(route.rule.command)}')
-            success, result = util.execute(route.rule.command)
-            if not success or not result:
-                print(f'command returned with:\n{result}')
-                if not 'already exists' in result and route.fatal:
-                    raise RuntimeError(f'failed to create rule {route.rule.name}')
-            if _args['veryverbose']: print(result)
+  parser.add_argument(
+    '--trace',
+    help="record every azure call, plan step and wait with its timing to TRACE.json (chrome trace) and TRACE.jsonl, and print time per phase",
+    metavar='TRACE')
 
-    # RULES ENGINE CONFIG
-    print('\nprocess rules engines.....')
+  parser.add_argument(
+    '--no-cache',
+    help="parse the config and run every lookup without reading or writing the compiled config and lookup caches (FDRM_CACHE_DIR, default ~/.cache/fdrm)",
+    action='store_true')
 
-    engine_list = config['engine-rules'] if 'engine-rules' in config else []
+  parser.add_argument(
+    '--executor',
+    help="az: run every call as an az process, worker: run az commands in warm az worker processes, arm: send management api calls in process over pooled connections (FDRM_ARM_ENDPOINT, FDRM_ARM_TOKEN) and the rest to warm az workers",
+    choices=['az', 'worker', 'arm'],
+    default='az')
 
-    found = []
-    engine_seq = []
-    for engine in engine_list:
-        if not engine in found:
-            found.append(engine)
-            engine_seq.append(engine)
+  _args = vars(parser.parse_args())
+  if _args['state_file'] and not _args['plan']:
+      parser.error('--state-file only plans, add --plan')
+  if _args['watch'] and (_args['whatif'] or _args['plan'] or _args['validate'] or _args['export_state']):
+      parser.error('--watch applies changes, it cannot be combined with --whatif, --plan, --validate or --export-state')
 
-    for engine_cfg in engine_seq:
-        _engine_name = next(iter(engine_cfg))
-        print(f'get Engine instance {next(iter(engine_cfg))}')
-        engine = Engine(engine_cfg, _engine_name, frontdoor_name, frontdoor_group)
-        rules = [r.name for r in engine.rules]
-        print(f'creating the following rules in engine {engine.name}\n{[r.name for r in engine.rules]}')
-
-        # PROCESS ENGINE RULES
-        for r in engine.rules:
-            if r.command and not _args ["whatif"]:
-                if _args['verbose']: print(f'{" ".join(r.command)}')
-                success, result = util.execute(r.command)
-                if not success or not result:
-                    print(f'command returned with:\n{result}')
-                    raise RuntimeError(f'failed to create rule {r.name}')
-                if _args['veryverbose']: print(result)
-
-            # PROCESS RULE ACTIONS
-            for a in r.actions:
-                if a.command and not _args ["whatif"]:
-                    if _args['verbose']: print(f'{" ".join(a.command)}')
-                    success, result = util.execute(a.command)
-                    if not success or not result:
-                        print(f'command returned with:\n{result}')
-                        raise RuntimeError(f'failed to create rule {r.name} action')
-                    if _args['veryverbose']: print(result)
-
-            # PROCESS RULE CONDITIONS
-            for c in r.conditions:
-                if c.command and not _args ["whatif"]:
-                    if _args['verbose']: print(f'{" ".join(c.command)}')
-                    success, result = util.execute(c.command)
-                    if not success or not result:
-                        print(f'command returned with:\n{result}')
-                        raise RuntimeError(f'failed to create rule {r.name} condition')
-                    if _args['veryverbose']: print(result)
+  if not os.path.isfile(_args['config']):
+      print(f'config {_args["config"]} not found, clean exit')
+      sys.exit(0)
 
+  executor = Executor.AzCliExecutor()
+  if _args['executor'] == 'worker':
+      executor = AzWorker.AzWorkerExecutor()
+  elif _args['executor'] == 'arm':
+      executor = Executor.ArmExecutor(fallback=AzWorker.AzWorkerExecutor())
+  # every call goes through one rate limiter, throttled calls are retried and lower the concurrency
+  executor = Throttle.ThrottledExecutor(executor, max(1, _args['parallelism']), max_retries=_args['max_retries'])
+  if _args['trace']:
+      tracer = Trace.Tracer(_args['trace'])
+      Trace.set_tracer(tracer)
+      executor = Trace.TracingExecutor(executor, tracer)
+      # also written when the run raises, the jsonl log is already complete up to that point
+      atexit.register(lambda: (tracer.summary(), tracer.close()))
+  # lookups kept from earlier runs are dropped for every resource this run writes
+  lookups = LookupCache.LookupCache(enabled=not _args['no_cache'])
+  LookupCache.set_cache(lookups)
+  executor = LookupCache.InvalidatingExecutor(executor, lookups)
+  util.set_executor(executor)
 
-    # LINK RULES ENGINE CONFIG
-    print('\nassociating rules to engines.....')
+  with open(_args['config']) as file:
+    # parsed, validated and deduplicated once per config content, later runs load the compiled json
+    config = ConfigCache.ConfigCache(enabled=not _args['no_cache']).load(file)
+
+  frontdoor_name = config['front-door-name']
+  frontdoor_group = config['front-door-group']
+
+  if _args['export_state']:
+      print(f'\nexport front door {frontdoor_name} state......')
+      with Trace.span('front door lookup', phase='state', kind='front door', resource=frontdoor_name):
+          snapshot = Document.Document.fetch(frontdoor_name, frontdoor_group)
+      with open(_args['export_state'], 'w') as f:
+          json.dump(snapshot, f, indent=1, sort_keys=True)
+      print(f'front door {frontdoor_name} state written to {_args["export_state"]}')
+      util.get_executor().close()
+      sys.exit(0)
 
-    link_list = config['engine-associations'] if 'engine-associations' in config else []
+  if _args['watch']:
+      script_error_status = watch(_args['config'], _args)
+  else:
+      script_error_status = reconcile(config, _args)
 
-    found = []
-    link_seq = []
-    for link in link_list:
-        if not link in found:
-            found.append(link)
-            link_seq.append(link)
+  util.get_executor().close()
 
-    for link_cfg in link_seq:
-        engine_name = next(iter(link_cfg))
-        print(f'Engine Association for engine: {engine_name}')
-        rules = [r for r in link_cfg[engine_name]]
-        for r in rules:
-            engine_assoc = EngineAssociation(r, engine_name, frontdoor_name, frontdoor_group)
-            if engine_assoc.command and not _args ["whatif"]:
-                if _args['verbose']: print(f'{" ".join(engine_assoc.command)}')
-                success, result = util.execute(engine_assoc.command)
-                if not success or not result:
-                    print(f'command returned with:\n{result}')
-                    raise RuntimeError(f'failed to link rule {r} to engine {engine_name}')
-                if _args['veryverbose']: print(result)
-
-
-    sys.exit(script_error_status)
+  sys.exit(script_error_status)
@@ -0,0 +1,166 @@
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+
+from routes import Executor
+
+'''
+warm az worker executor class
+'''
+class AzWorkerExecutor(Executor.Executor):
+    '''
+    This keeps long lived python processes that import the azure cli core once and then run az argument lists
+    sent to them over a pipe, one json line per command and one json line back with the exit code, stdout and
+    stderr. That saves the interpreter and cli startup every az process pays. One worker runs one command at
+    a time, so a worker is started per concurrent caller and reused after.
+    If the worker cannot import the cli, every command falls back to a plain az process.
+
+    FDRM_AZ_PYTHON overrides the interpreter the worker runs with, by default it is read from the az launcher.
+    '''
+    def __init__(self, fallback: Executor.Executor = None):
+        self.fallback = fallback or Executor.AzCliExecutor()
+        self.disabled = False
+        self.idle = []
+        self.workers = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def interpreter(cls):
+        """
+        :return: the python the az cli is installed in, the worker has to import the cli from there
+        """
+        if os.environ.get('FDRM_AZ_PYTHON'):
+            return os.environ['FDRM_AZ_PYTHON']
+        az = shutil.which('az')
+        if az:
+            try:
+                with open(az, errors='ignore') as f:
+                    launcher = f.read(4096)
+                # the bundled launcher is a shell script ending in: /opt/az/bin/python3 -Im azure.cli "$@"
+                match = re.search(r'^\s*"?([^\s"$]*python[\d.]*)"?\s+-\w*m\s+azure\.cli', launcher, re.MULTILINE)
+                if match and os.path.isfile(match.group(1)):
+                    return match.group(1)
+                # pip installs a python entry point script
+                if launcher.startswith('#!') and 'python' in launcher.splitlines()[0]:
+                    return launcher.splitlines()[0][2:].strip().split()[0]
+            except OSError:
+                pass
+        return sys.executable
+
+    def spawn(self):
+        """
+        :return: a started worker, None if the cli could not be loaded
+        """
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        proc = subprocess.Popen([self.interpreter(), '-m', 'routes.AzWorker'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                universal_newlines=True, env=env)
+        ready = json.loads(proc.stdout.readline() or '{}')
+        if not ready.get('ready'):
+            print(f'az worker unavailable, running az commands as processes: {ready.get("error")}')
+            proc.kill()
+            proc.wait()
+            return None
+        with self._lock:
+            self.workers.append(proc)
+        return proc
+
+    def acquire(self):
+        with self._lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.spawn()
+
+    def release(self, proc):
+        with self._lock:
+            self.idle.append(proc)
+
+    def discard(self, proc):
+        proc.kill()
+        proc.wait()
+        with self._lock:
+            self.workers.remove(proc)
+
+    def call(self, proc, command: list, timeout: int = None):
+        # a hung command kills its worker, the next command starts a new one
+        timer = threading.Timer(timeout, proc.kill) if timeout else None
+        if timer: timer.start()
+        try:
+            proc.stdin.write(json.dumps(command) + '\n')
+            proc.stdin.flush()
+            reply = proc.stdout.readline()
+        finally:
+            if timer: timer.cancel()
+        if not reply:
+            raise RuntimeError(f'az worker exited with {proc.poll()}')
+        reply = json.loads(reply)
+        return subprocess.CompletedProcess(command, reply['returncode'], reply['stdout'], reply['stderr'])
+
+    def run(self, command: list, timeout: int = None):
+        if self.disabled or command[:1] != ['az']:
+            return self.fallback.run(command, timeout)
+
+        proc = self.acquire()
+        if not proc:
+            self.disabled = True
+            return self.fallback.run(command, timeout)
+
+        try:
+            result = self.call(proc, command, timeout)
+        except Exception as e:
+            # not retried, a write may have gone out before the worker died
+            self.discard(proc)
+            return subprocess.CompletedProcess(command, 1, '', f'ERROR: az worker failed running {" ".join(command)}: {str(e)}')
+        self.release(proc)
+        return result
+
+    def close(self):
+        with self._lock:
+            workers, self.workers, self.idle = self.workers, [], []
+        for proc in workers:
+            proc.stdin.close()
+            proc.wait()
+
+
+def serve():
+    '''
+    worker side, run with the az cli python: read one json argument list per line, invoke the cli in process
+    '''
+    # keep the real stdout for replies, anything written straight to fd 1 goes to stderr instead
+    replies = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    def reply(message: dict):
+        replies.write(json.dumps(message) + '\n')
+        replies.flush()
+
+    try:
+        from azure.cli.core import get_default_cli
+    except Exception as e:
+        reply({'ready': False, 'error': str(e)})
+        return
+    reply({'ready': True})
+
+    for line in sys.stdin:
+        command = json.loads(line)
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                returncode = get_default_cli().invoke(command[1:], out_file=out)
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                err.write(f'ERROR: {str(e)}\n')
+                returncode = 1
+        reply({'returncode': returncode or 0, 'stdout': out.getvalue(), 'stderr': err.getvalue()})
+
+
+if __name__ == '__main__':
+    serve()
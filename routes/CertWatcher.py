@@ -0,0 +1,103 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+from routes import Utility as util
+from routes import Document
+from routes import Trace
+
+'''
+cert provisioning watcher class
+'''
+class CertWatcher(object):
+    '''
+    This tracks the customHttpsProvisioningState of every frontend that had enable-https submitted.
+    Each frontend is polled by its own coroutine on an asyncio loop in a background thread, with exponential
+    backoff between lookups, so the rest of the run keeps going while certificates are provisioned.
+    results() blocks until every frontend has left the Enabling state or timed out.
+    '''
+    def __init__(self, fd_name: str, fd_group: str, timeout: int = 7200, interval: int = 30, max_interval: int = 300, desired_status: str = 'Enabled'):
+        self.fd_name = fd_name
+        self.fd_group = fd_group
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.desired_status = desired_status
+        self.loop = None
+        self.thread = None
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def watch(self, frontend: str):
+        '''
+        start tracking a frontend, called once its enable-https command has been accepted
+        '''
+        with self._lock:
+            if not self.loop:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='cert-watcher', daemon=True)
+                self.thread.start()
+            print(f'watching cert provisioning for frontend {frontend}, timeout set to {(self.timeout / 60)} minutes')
+            self.pending[frontend] = asyncio.run_coroutine_threadsafe(self.poll(frontend), self.loop)
+
+    async def status(self, frontend: str):
+        """
+        :return: the current customHttpsProvisioningState of the frontend, None if the lookup failed
+        """
+        _id = f'/subscriptions/{{subscriptionId}}/resourceGroups/{self.fd_group}/providers/Microsoft.Network/frontDoors/{self.fd_name}'
+        command = ['az', 'rest', '--method', 'get', '--url', Document.Document.url(f'{_id}/frontendEndpoints/{frontend}'),
+                   '--query', 'properties.customHttpsProvisioningState']
+
+        try:
+            # the executor call blocks, run it on the default thread pool so the other frontends keep polling
+            def _run():
+                with Trace.span('cert status', phase='cert', kind='frontend', resource=frontend):
+                    return util.run(command)
+            result = await asyncio.get_running_loop().run_in_executor(None, _run)
+            if result.returncode != 0 or not result.stdout:
+                return None
+            _status = json.loads(result.stdout)
+            # executors that do not apply the projection return the whole frontend
+            if isinstance(_status, dict):
+                _status = (_status.get('properties') or {}).get('customHttpsProvisioningState')
+            return _status
+        except Exception as e:
+            print(f'failed to get frontend {frontend} config: {str(e)}')
+            return None
+
+    async def poll(self, frontend: str):
+        """
+        :return: (True|False, status) once the frontend is no longer Enabling or the timeout is reached
+        """
+        started = time.perf_counter()
+        deadline = self.loop.time() + self.timeout
+        delay = self.interval
+        current_status = None
+        while True:
+            current_status = await self.status(frontend)
+            if current_status and current_status != 'Enabling':
+                break
+            if self.loop.time() + delay > deadline:
+                break
+            await asyncio.sleep(delay + random.uniform(0, delay / 10))
+            delay = min(delay * 2, self.max_interval)
+        # coroutines interleave on the loop thread, so the watch is recorded as one span once it is over
+        Trace.get().record('cert provisioning', 'wait', started, time.perf_counter(), 'cert', 'frontend', frontend, {'status': current_status})
+        return current_status == self.desired_status, current_status
+
+    def results(self):
+        """
+        :return: dict of frontend name to (True|False, status) for every watched frontend
+        """
+        _results = {}
+        for frontend, future in self.pending.items():
+            try:
+                _results[frontend] = future.result()
+            except Exception as e:
+                _results[frontend] = (False, str(e))
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        return _results
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+
+import yaml
+
+from routes import Normalize
+
+'''
+compiled config cache class
+'''
+class ConfigCache(object):
+    '''
+    This parses, validates and normalizes the yaml config once and keeps the result on disk as json, keyed by the
+    sha256 of the config content and the tool version. A repeat run over an unchanged config loads the json
+    instead of parsing yaml again. The tool version is a hash of the tool's own source, so any code change
+    invalidates every entry. The model graph itself is not cached, it is built from the live front door.
+
+    FDRM_CACHE_DIR overrides the cache directory, ~/.cache/fdrm by default.
+    '''
+
+    # libyaml when it is installed, the pure python loader otherwise
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+    _version = None
+
+    @classmethod
+    def tool_version(cls):
+        """
+        :return: hash of the tool source files
+        """
+        if not cls._version:
+            root = pathlib.Path(__file__).resolve().parent.parent
+            digest = hashlib.sha256()
+            for source in sorted([root / 'frontdoor_route_manager.py'] + list(root.glob('routes/*.py')) + list(root.glob('engines/*.py'))):
+                digest.update(source.name.encode('utf-8'))
+                digest.update(source.read_bytes())
+            cls._version = digest.hexdigest()[:16]
+        return cls._version
+
+    @classmethod
+    def compile(cls, config: dict):
+        """
+        :return: the validated config with duplicate routes, engines and engine associations dropped
+        """
+        if not isinstance(config, dict):
+            raise TypeError('config must be a yaml mapping')
+
+        if not 'front-door-name' in config:
+            raise TypeError('missing frontdoor name config')
+
+        if not 'front-door-group' in config:
+            raise TypeError('missing frontdoor group config')
+
+        if not 'routing-rules' in config:
+            raise TypeError('missing routing-rules config')
+
+        compiled = dict(config)
+        compiled['routing-rules'] = Normalize.unique(config['routing-rules'])
+        compiled['engine-rules'] = Normalize.unique(config['engine-rules'] if 'engine-rules' in config else [])
+        compiled['engine-associations'] = Normalize.unique(config['engine-associations'] if 'engine-associations' in config else [])
+        # round trip through json once here, so a fresh parse and a cache hit give the models the same plain data
+        return json.loads(json.dumps(compiled, default=str))
+
+    def __init__(self, directory: str = None, enabled: bool = True):
+        self.directory = directory or os.environ.get('FDRM_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'fdrm')
+        self.enabled = enabled
+
+    def path(self, content: str):
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{key}-{self.tool_version()}.json')
+
+    def load(self, file):
+        """
+        :return: the compiled config of an open config file, from the cache when the content was compiled before
+        """
+        content = file.read()
+        if not self.enabled:
+            return self.compile(yaml.load(content, Loader=self.loader))
+
+        _path = self.path(content)
+        try:
+            with open(_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        compiled = self.compile(yaml.load(content, Loader=self.loader))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write then rename, a concurrent run never reads a partial entry
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as f:
+                json.dump(compiled, f)
+            os.replace(f.name, _path)
+        except OSError as e:
+            print(f'config cache not written: {str(e)}')
+        return compiled
@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dns
+from dns import resolver
+
+from routes import Trace
+
+'''
+dns lookup cache class
+'''
+class DnsCache(object):
+    '''
+    This resolves CNAME records and keeps each answer until its TTL runs out. A failed lookup (no record, no
+    domain, timeout) is kept for negative_ttl seconds. Concurrent lookups of the same name wait for the first
+    one, so a name is queried once however many frontends use it. Every query gives up after timeout seconds,
+    an unresponsive name server cannot stall the run.
+    '''
+    def __init__(self, timeout: float = 5, negative_ttl: int = 60):
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.answers = {}
+        self._resolver = None
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def resolver(self):
+        if not self._resolver:
+            self._resolver = resolver.Resolver()
+            self._resolver.lifetime = self.timeout
+        return self._resolver
+
+    def query(self, hostname: str):
+        """
+        :return: ([cname targets], error, ttl) from the name servers
+        """
+        try:
+            answer = self.resolver().resolve(hostname, rdtype=dns.rdatatype.CNAME)
+            return [str(a) for a in answer], None, answer.rrset.ttl
+        except Exception as e:
+            return [], f'{type(e).__name__}: {str(e)}', self.negative_ttl
+
+    def cname(self, hostname: str):
+        """
+        :return: ([cname targets], error) for the host name, error is None when the lookup succeeded
+        """
+        key = hostname.lower().rstrip('.')
+        while True:
+            with self._lock:
+                cached = self.answers.get(key)
+                if cached and cached[2] > time.monotonic():
+                    return cached[0], cached[1]
+                pending = self._pending.get(key)
+                if not pending:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            with Trace.span('dns lookup', phase='frontend', kind='dns', resource=key) as _span:
+                targets, error, ttl = self.query(key)
+                _span['error'] = error
+            with self._lock:
+                self.answers[key] = (targets, error, time.monotonic() + ttl)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return targets, error
+
+    def forget(self, hostname: str):
+        ''' drop the kept answer for the host name, the next lookup asks the name servers again '''
+        with self._lock:
+            self.answers.pop(hostname.lower().rstrip('.'), None)
+
+    def wait_cname(self, hostname: str, target: str, timeout: float = 120, interval: float = 5):
+        """
+        look the host name up again until it maps to target, a record this run just created is not answered
+        from a miss kept before it existed
+        :return: ([cname targets], error) of the last lookup
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.forget(hostname)
+            targets, error = self.cname(hostname)
+            if target in targets or time.monotonic() + interval > deadline:
+                return targets, error
+            time.sleep(interval)
+
+    def preflight(self, checks: list, workers: int = 16):
+        """
+        :param checks: (frontend name, host name, expected cname target) for every frontend to validate
+        :return: an error message for every frontend whose host name is not mapped to its target
+        """
+        hostnames = sorted(set(c[1] for c in checks))
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hostnames) or 1))) as pool:
+            list(pool.map(self.cname, hostnames))
+
+        failures = []
+        for name, hostname, target in checks:
+            targets, error = self.cname(hostname)
+            if error:
+                failures.append(f'{name}: {hostname} lookup failed, {error}')
+            elif not target in targets:
+                failures.append(f'{name}: {hostname} mapped to {", ".join(targets) or "nothing"}, expected {target}')
+        return failures
+
+
+_cache = DnsCache()
+
+def get():
+    return _cache
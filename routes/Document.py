@@ -0,0 +1,232 @@
+import copy
+import json
+import time
+
+from routes import Utility as util
+from routes import LookupCache, Normalize, Plan
+
+'''
+front door arm document class
+'''
+class Document(object):
+    '''
+    This represents the full arm front door resource. Instead of one az sub-command per frontend, probe, pool
+    and rule (each of which is a read-modify-write of the whole front door on the service side) every model is
+    compiled into its arm json, merged into the fetched document and applied with a single PUT.
+    Rules engines are child resources in arm, so each changed engine is one more PUT.
+    '''
+
+    api_version = '2020-05-01'
+
+    # sub resource reference keys used by the models, and the front door collection they point into
+    refs = {
+        'frontendEndpoints': 'frontendEndpoints',
+        'backendPool': 'backendPools',
+        'healthProbeSettings': 'healthProbeSettings',
+        'loadBalancingSettings': 'loadBalancingSettings',
+        'rulesEngine': 'rulesEngines',
+        'webApplicationFirewallPolicyLink': None
+    }
+
+    # read only properties the service returns but does not accept back
+    read_only = ['provisioningState', 'resourceState', 'cname', 'frontdoorId', 'rulesEngines', 'extendedProperties']
+
+    @classmethod
+    def url(cls, resource_id: str):
+        return f'{resource_id}?api-version={cls.api_version}'
+
+    @classmethod
+    def expand(cls, value, fd_id: str, key: str = None):
+        """
+        :return: the value with every model {'id': name} reference expanded to the full front door sub resource id
+        """
+        if isinstance(value, dict):
+            if key in cls.refs and list(value) == ['id'] and value['id'] and not value['id'].startswith('/'):
+                return {'id': f'{fd_id}/{cls.refs[key]}/{value["id"]}'}
+            return {k: cls.expand(v, fd_id, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls.expand(v, fd_id, key) for v in value]
+        return value
+
+    @classmethod
+    def fetch(cls, fd_name: str, fd_group: str):
+        """
+        :return: the arm front door document, including rules engines
+        """
+        _id = f'/subscriptions/{{subscriptionId}}/resourceGroups/{fd_group}/providers/Microsoft.Network/frontDoors/{fd_name}'
+        # revalidated by etag against the copy kept from the last run
+        _result = LookupCache.get().lookup(_id, ['az', 'rest', '--method', 'get', '--url', cls.url(_id)], util.run, etag=True)
+        if _result.returncode != 0 or not _result.stdout:
+            raise RuntimeError(f'failed to get front door {fd_name} in {fd_group}\n{_result.stderr}')
+        document = json.loads(_result.stdout)
+
+        engines = document['properties'].get('rulesEngines') or []
+        if any(not 'rules' in (e.get('properties') or {}) for e in engines):
+            success, result = util.execute(['az', 'rest', '--method', 'get', '--url', cls.url(f'{document["id"]}/rulesEngines')])
+            if not success:
+                raise RuntimeError(f'failed to list rules engines for front door {fd_name}\n{result}')
+            document['properties']['rulesEngines'] = result['value'] if result else []
+        return document
+
+    @classmethod
+    def wait_provisioned(cls, resource_id: str, timeout: int = 3600, interval: int = 15):
+        """
+        :return: (True|False, provisioningState) once the long running PUT is no longer in progress
+        """
+        status = None
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            # only the two state fields, not the whole front door on every poll
+            success, result = util.execute(['az', 'rest', '--method', 'get', '--url', cls.url(resource_id),
+                                            '--query', 'properties.{provisioningState:provisioningState,resourceState:resourceState}'])
+            if success and result:
+                # executors that do not apply the projection return the whole resource
+                _properties = result.get('properties', result)
+                status = _properties.get('provisioningState') or _properties.get('resourceState')
+                if status in ['Succeeded', 'Failed', 'Canceled', 'Enabled', 'Disabled']:
+                    break
+            time.sleep(interval)
+        return status in ['Succeeded', 'Enabled'], status
+
+    @classmethod
+    def version(cls, document: dict, ignore: list = None):
+        """
+        :param ignore: more properties to leave out of the fingerprint
+        :return: the document etag, or a fingerprint of its properties when the front door has no etag.
+        The provisioning and resource state are left out, they move without any change to the front door.
+        """
+        if document.get('etag'):
+            return document['etag']
+        _ignore = ['provisioningState', 'resourceState'] + (ignore or [])
+        return Normalize.fingerprint({k: v for k, v in (document.get('properties') or {}).items() if not k in _ignore})
+
+    @classmethod
+    def put(cls, resource_id: str, etag: str = None):
+        """
+        :return: az rest command replacing the resource, guarded by etag when given. The body goes to the plan
+        Operation, which writes it to a file only while the command runs.
+        """
+        command = ['az', 'rest', '--method', 'put', '--url', cls.url(resource_id)]
+        if etag:
+            command.extend(['--headers', f'If-Match={etag}'])
+        return command
+
+    def __init__(self, fd_name: str, fd_group: str, current: dict = None):
+        self.fd_name = fd_name
+        self.fd_group = fd_group
+        self.current = current or self.fetch(fd_name, fd_group)
+        self.id = self.current['id']
+        self.etag = self.current.get('etag')
+        # without an etag the front door PUTs are guarded by reading the document again just before them,
+        # the rules engines are left out as the engine PUTs between the two front door PUTs change them
+        self.seen = None if self.etag else self.version(self.current, ['rulesEngines'])
+
+        self.target = copy.deepcopy(self.current)
+        for k in self.read_only:
+            self.target['properties'].pop(k, None)
+
+        self.engines = {}
+        for e in self.current['properties'].get('rulesEngines') or []:
+            self.engines[e['name'].lower()] = e
+        self.engine_targets = {}
+        self.links = {}
+
+    def merge(self, kind: str, item: dict):
+        '''
+        replace the properties we manage on an existing sub resource, or append a new one
+        '''
+        item = self.expand(item, self.id)
+        collection = self.target['properties'].setdefault(kind, [])
+        for existing in collection:
+            if existing['name'].lower() == item['name'].lower():
+                existing.setdefault('properties', {}).update(item['properties'])
+                return
+        collection.append(item)
+
+    def add_route(self, route):
+        for frontend in route.frontends:
+            if frontend.create_frontend:
+                self.merge('frontendEndpoints', {'name': frontend.name, 'properties': frontend.desired()})
+
+        if route.pool and route.pool.create_pool:
+            if route.pool.probe and route.pool.probe.action:
+                self.merge('healthProbeSettings', {'name': route.pool.probe.name, 'properties': route.pool.probe.desired()})
+            if route.pool.loadbalancing and route.pool.loadbalancing.action:
+                self.merge('loadBalancingSettings', {'name': route.pool.loadbalancing.name, 'properties': route.pool.loadbalancing.desired()})
+            self.merge('backendPools', {'name': route.pool.name, 'properties': route.pool.desired()})
+
+        if route.rule.ruletype and route.rule.action:
+            self.merge('routingRules', {'name': route.rule.name, 'properties': route.rule.compile()})
+
+    def add_engine(self, engine):
+        '''
+        compile the engine rules over the live engine, rules that are not in the config are kept as they are
+        '''
+        self.engine_targets[engine.name.lower()] = self.expand(engine.compile(), self.id)
+
+    def associate(self, rule: str, engine: str):
+        self.links[rule.lower()] = engine
+
+    def check_unchanged(self):
+        """
+        raise when the front door changed since it was read, the If-Match of a front door without an etag
+        """
+        live = self.fetch(self.fd_name, self.fd_group)
+        if self.version(live, ['rulesEngines']) != self.seen:
+            raise RuntimeError(f'front door {self.fd_name} changed since it was read and has no etag to guard the PUT, '
+                               f'not overwriting it, run again to plan over the current front door')
+
+    def wait_written(self):
+        """
+        :return: (True|False, provisioningState) of the front door PUT, taking the document it left as seen
+        """
+        result = self.wait_provisioned(self.id)
+        if not self.etag:
+            self.seen = self.version(self.fetch(self.fd_name, self.fd_group), ['rulesEngines'])
+        return result
+
+    def _apply_links(self, body: dict, engines: list):
+        for r in body['properties'].get('routingRules') or []:
+            engine = self.links.get(r['name'].lower())
+            if engine and engine.lower() in engines:
+                r.setdefault('properties', {})['rulesEngine'] = {'id': f'{self.id}/rulesEngines/{engine}'}
+
+    def plan(self, plan):
+        '''
+        add the front door PUT, one PUT per changed rules engine and, when a rule links to an engine that
+        does not exist yet, a second front door PUT for those links once the engines are created.
+        The engine PUTs can run together, they only wait on the front door PUT.
+        :return: the last front door Operation, None if the document is unchanged
+        '''
+        existing = list(self.engines)
+        self._apply_links(self.target, existing)
+        check = None
+        if not self.etag:
+            check = self.check_unchanged
+            print(f'front door {self.fd_name} has no etag, the PUT is sent without If-Match and is only guarded by reading '
+                  f'the front door again just before it')
+
+        document_op = None
+        changes = [k for k in self.target['properties'] if util.differs(self.target['properties'][k], self.current['properties'].get(k))]
+        if changes:
+            document_op = plan.add(Plan.Operation('update', 'front door', self.fd_name, self.put(self.id, self.etag), changes=changes,
+                                                  wait=self.wait_written, body=self.target, check=check))
+
+        engine_ops = []
+
+        for key, body in self.engine_targets.items():
+            live = self.engines.get(key)
+            live_rules = (live or {}).get('properties', {}).get('rules')
+            if live and not util.differs(body['properties']['rules'], live_rules):
+                continue
+            _id = f'{self.id}/rulesEngines/{body["name"]}'
+            engine_ops.append(plan.add(Plan.Operation('update' if live else 'create', 'rules engine', body['name'], self.put(_id),
+                                                      changes=['rules'] if live else [], after=[document_op], body=body)))
+
+        created = [k for k in self.engine_targets if not k in existing]
+        if any(e.lower() in created for e in self.links.values()):
+            linked = copy.deepcopy(self.target)
+            self._apply_links(linked, existing + created)
+            document_op = plan.add(Plan.Operation('update', 'front door links', self.fd_name, self.put(self.id), changes=['routingRules'],
+                                                  wait=self.wait_written, after=[document_op] + engine_ops, body=linked, check=check))
+        return document_op
@@ -0,0 +1,163 @@
+import http.client
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+import urllib.parse
+
+'''
+command execution backend classes
+'''
+class Executor(object):
+    '''
+    This is the interface every az call goes through. run() takes an az argument list and returns a
+    subprocess.CompletedProcess with text output, so callers read returncode, stdout and stderr the same
+    way whichever backend is in use.
+    '''
+    def run(self, command: list, timeout: int = None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class AzCliExecutor(Executor):
+    '''
+    runs every command as its own az process, the original behavior
+    '''
+    def run(self, command: list, timeout: int = None):
+        return subprocess.run(command, universal_newlines=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, timeout=timeout)
+
+
+class ArmExecutor(Executor):
+    '''
+    This talks to the azure management api in process. `az rest` commands, which is everything the document
+    apply mode and the state lookup send, become requests over one persistent keep-alive connection per thread,
+    authenticated with a single token shared by every thread. Any other az command is handed to the fallback
+    executor, since there is no management api equivalent we can build from its arguments.
+
+    FDRM_ARM_ENDPOINT overrides the management endpoint (a plain http://host:port stand-in server works),
+    FDRM_ARM_TOKEN supplies a token instead of asking az for one.
+    '''
+    resource = 'https://management.azure.com/'
+
+    def __init__(self, endpoint: str = None, token: str = None, subscription: str = None, fallback: Executor = None, timeout: int = 120):
+        self.endpoint = urllib.parse.urlsplit(endpoint or os.environ.get('FDRM_ARM_ENDPOINT') or self.resource)
+        self.subscription = subscription or os.environ.get('ARM_SUBSCRIPTION_ID')
+        self.fallback = fallback or AzCliExecutor()
+        self.timeout = timeout
+        self._token = token or os.environ.get('FDRM_ARM_TOKEN')
+        self._token_expires = float('inf') if self._token else 0
+        self._token_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+
+    def token(self):
+        """
+        :return: a bearer token, fetched from az once and refreshed only when it is about to expire
+        """
+        with self._token_lock:
+            if not self._token or time.time() > self._token_expires - 300:
+                result = self.fallback.run(['az', 'account', 'get-access-token', '--resource', self.resource, '-o', 'json'])
+                if result.returncode != 0:
+                    raise RuntimeError(f'failed to get a management api token\n{result.stderr}')
+                data = json.loads(result.stdout)
+                self._token = data['accessToken']
+                self._token_expires = data['expires_on'] if 'expires_on' in data else time.time() + 3000
+                self.subscription = self.subscription or data.get('subscription')
+            return self._token
+
+    def connection(self, fresh: bool = False):
+        conn = getattr(self._local, 'conn', None)
+        if fresh and conn:
+            conn.close()
+            conn = None
+        if not conn:
+            _class = http.client.HTTPSConnection if self.endpoint.scheme == 'https' else http.client.HTTPConnection
+            conn = _class(self.endpoint.hostname, self.endpoint.port, timeout=self.timeout)
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def request(self, method: str, url: str, body=None, headers: dict = None):
+        """
+        :return: (http status, response body text, response headers)
+        """
+        _token = self.token()
+        if '{subscriptionId}' in url:
+            if not self.subscription:
+                raise RuntimeError('subscription id unknown, set ARM_SUBSCRIPTION_ID')
+            url = url.replace('{subscriptionId}', self.subscription)
+        _url = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(('', '', _url.path, _url.query, ''))
+
+        _headers = {'Authorization': f'Bearer {_token}', 'Accept': 'application/json', 'Connection': 'keep-alive'}
+        if body is not None:
+            body = body if isinstance(body, (str, bytes)) else json.dumps(body)
+            _headers['Content-Type'] = 'application/json'
+        _headers.update(headers or {})
+
+        for attempt in range(2):
+            conn = self.connection(fresh=attempt > 0)
+            reused = conn.sock is not None
+            try:
+                conn.request(method.upper(), path, body=body, headers=_headers)
+                response = conn.getresponse()
+                return response.status, response.read().decode('utf-8'), dict(response.getheaders())
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server closed an idle keep-alive connection, reconnect once. A fresh connection failing
+                # this way may have delivered the request, so it is not sent again
+                conn.close()
+                if attempt or not reused:
+                    raise
+            except Exception:
+                # a timeout or any other failure may have reached the server, a write is never replayed
+                conn.close()
+                raise
+
+    @classmethod
+    def parse_rest(cls, command: list):
+        """
+        :return: (method, url, body, headers) from an `az rest` argument list
+        """
+        args = {'--method': 'get', '--url': None, '--body': None, '--headers': []}
+        key = None
+        for a in command[2:]:
+            if a.startswith('--'):
+                key = a
+            elif key == '--headers':
+                args[key].append(a)
+            elif key:
+                args[key] = a
+        body = args['--body']
+        if body and body.startswith('@'):
+            with open(body[1:]) as f:
+                body = f.read()
+        headers = {}
+        for h in args['--headers']:
+            for pair in shlex.split(h):
+                k, _, v = pair.partition('=')
+                headers[k] = v
+        return args['--method'], args['--url'], body, headers
+
+    def run(self, command: list, timeout: int = None):
+        if command[:2] != ['az', 'rest']:
+            return self.fallback.run(command, timeout)
+
+        method, url, body, headers = self.parse_rest(command)
+        try:
+            status, text, _headers = self.request(method, url, body, headers)
+        except Exception as e:
+            return subprocess.CompletedProcess(command, 1, '', f'ERROR: {str(e)}')
+        if status >= 400:
+            _retry = {k.lower(): v for k, v in _headers.items()}.get('retry-after')
+            return subprocess.CompletedProcess(command, 1, '', f'ERROR: ({status}) {text}' + (f'\nRetry-After: {_retry}' if _retry else ''))
+        return subprocess.CompletedProcess(command, 0, text, '')
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        self.fallback.close()
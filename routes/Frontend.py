@@ -1,92 +1,132 @@
 import json
 import os
 import pathlib
-import subprocess
-import traceback
 
-import dns
-from dns import resolver
-
-from routes.Utility import assert_command_succeeded
+from routes import LookupCache
+from routes.Utility import assert_command_succeeded, provisioning_needed, run
 
 
 class Frontend(object):
+    # looked up once per run while planning, every key vault frontend uses the same principal and most share a vault
+    front_door_app_id = 'ad0e1c7e-6d38-4ba4-9efd-0bc77ba9f037'
+    _front_door_sp = None
+    _vault_access = {}
+
+    @classmethod
+    def reset(cls):
+        ''' forget the vault access read by an earlier pass of a long running watch, the principal is kept '''
+        cls._vault_access = {}
+
     @classmethod
     def get_front_door_sp(cls):
         """
         :return: a dictionary containing the front door service principal's attributes
         """
-        result = subprocess.run(
-            ['az', 'ad', 'sp', 'show', '--id', 'ad0e1c7e-6d38-4ba4-9efd-0bc77ba9f037'], capture_output=True)
-        assert_command_succeeded(result, f'failed to get Frontdoor service principal.')
-        return json.loads(result.stdout)
+        if cls._front_door_sp is None:
+            # the object id of the well known front door application does not change within a tenant, keep it for a day
+            result = LookupCache.get().lookup(f'ad/sp/{cls.front_door_app_id}', ['az', 'ad', 'sp', 'show', '--id', cls.front_door_app_id], run, ttl=86400)
+            assert_command_succeeded(result, f'failed to get Frontdoor service principal.')
+            cls._front_door_sp = json.loads(result.stdout)
+        return cls._front_door_sp
 
     @classmethod
-    def get_front_door_id(cls, fdname, fdgroup):
+    def vault_access_missing(cls, vault: dict, object_id: str):
         """
-        :return: string resource id for a given frontdoor
+        :return: the certificate and secret get permissions the principal lacks in the vault access policies
         """
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'show', '--name', fdname, '-g', fdgroup], capture_output=True)
-
-        assert_command_succeeded(result, f'failed to get Frontdoor ID.')
-        return json.loads(result.stdout)
+        missing = {'certificates', 'secrets'}
+        # the projected vault or the whole one
+        for policy in (vault.get('properties') or vault).get('accessPolicies') or []:
+            if str(policy.get('objectId')).lower() != object_id.lower():
+                continue
+            permissions = policy.get('permissions') or {}
+            for kind in list(missing):
+                if {str(p).lower() for p in permissions.get(kind) or []} & {'get', 'all'}:
+                    missing.discard(kind)
+        return sorted(missing)
 
     @classmethod
-    def get_frontend(cls, fdname, fdgroup, fename):
-        result = subprocess.run(
-            ['az', 'network', 'front-door', 'frontend-endpoint', 'show', '-f', fdname, '-g', fdgroup, '-n', fename],
-            capture_output=True)
-        assert_command_succeeded(result, f'Failed getting frontend {fename} in front door {fdname}')
-        return json.loads(result.stdout)
+    def vault_access_needed(cls, vault_name: str, object_id: str):
+        """
+        :return: True|False if the front door principal lacks get access to the vault, read once per vault
+        """
+        if not vault_name.lower() in cls._vault_access:
+            _command = ['az', 'keyvault', 'show', '-n', vault_name,
+                        '--query', '{accessPolicies:properties.accessPolicies,enableRbacAuthorization:properties.enableRbacAuthorization}']
+            # read fresh every run, a policy removed out of band must be granted again before cert provisioning
+            _result = run(_command, timeout=120)
+            vault = json.loads(_result.stdout or '{}') if _result.returncode == 0 else {}
+            if _result.returncode != 0:
+                print(f'read key vault {vault_name} result {_result.returncode}, the access policy will be set')
+                needed = True
+            elif (vault.get('properties') or vault).get('enableRbacAuthorization'):
+                print(f'key vault {vault_name} uses rbac authorization, access policies are not used')
+                needed = False
+            else:
+                needed = bool(cls.vault_access_missing(vault, object_id))
+            cls._vault_access[vault_name.lower()] = needed
+        return cls._vault_access[vault_name.lower()]
 
     @classmethod
-    def create_frontend_cname(cls, zonegroup, zonename, recordname, target):
+    def vault_access_command(cls, vault_name: str, object_id: str):
         """
-        :return: true | false
+        set front door key vault access policy according to:
+        https://docs.microsoft.com/en-us/azure/frontdoor/front-door-custom-domain-https#grant-azure-front-door-access-to-your-key-vault
+        :return: the az command granting the front door principal get on the vault certificates and secrets
         """
-        result = subprocess.run(
-            ['az', 'network', 'dns', 'record-set', 'cname', 'create', '--name', recordname,
-            '--resource-group', zonegroup, '--ttl', '300', '--zone-name', zonename, '--target-resource', target], capture_output=True)
+        _cmd = ['az', 'keyvault', 'set-policy', '-n', vault_name]
+        _cmd.extend(['--certificate-permissions', 'get'])
+        _cmd.extend(['--secret-permissions', 'get'])
+        _cmd.extend(['--object-id', object_id])
+        _cmd.extend(['-o', 'none'])
+        return _cmd
 
-        assert result.returncode == 0, f'failed to create cname.\nstderr:\n{result.stderr}'
-        return result.stdout
+    @classmethod
+    def create_cname_command(cls, zonegroup, zonename, recordname, target):
+        """
+        :return: the az command creating the frontend cname record in its dns zone
+        """
+        return ['az', 'network', 'dns', 'record-set', 'cname', 'create', '--name', recordname,
+            '--resource-group', zonegroup, '--ttl', '300', '--zone-name', zonename, '--target-resource', target]
 
     @classmethod
-    def valid_dns_config_for_fd_cert(cls, frontend):
+    def dns_checks(cls, rule_list: list, fd_name: str, state):
         """
-        :param frontend: the frontend to validate
         if the frontend certificate type is set to FrontDoor, ensure that a CNAME mapping the frontend custom domain to
         the Front Door '.azurefd.net' hostname is configure as documented here:
         https://docs.microsoft.com/en-us/azure/frontdoor/front-door-custom-domain-https
         The document mentions that Front Door will fall back to email validation if a CNAME is not configured. We have
         found that, for at least some frontends, Front Door will get stuck in the domain validation
         state whem an attempt is made to configure a Front Door managed cert. The only way to rollback is to recreate
-        the frontend (outage city; population: you). This check will cause the route manager to fail before attempting
+        the frontend (outage city; population: you). The dns preflight fails the run before attempting
         to create a Front Door managed cert with an unsupported DNS configuration.
+        A frontend whose cname this run creates is left out, it is checked once the cname op has run.
+        :return: (frontend name, host name, expected cname target) for every frontend of the routes that enables
+        ssl with a front door managed cert, the input of the dns preflight
         """
+        frontend_cfgs = [f for r in rule_list for f in r.get('frontends') or [] if isinstance(f, dict) and f]
+        hostnames = {next(iter(f)): f['host-name'] for f in frontend_cfgs if 'host-name' in f}
+        created = {next(iter(f)) for f in frontend_cfgs if f.get('exists') is False and f.get('create_cname') and not state.frontend(next(iter(f)))}
+        checks = []
+        for f in frontend_cfgs:
+            name = next(iter(f))
+            if f.get('certificate-type') != 'FrontDoor' or not f.get('enable-ssl') or name in created:
+                continue
+            hostname = hostnames.get(name) or (state.frontend(name) or {}).get('hostName')
+            # a frontend that cannot be found fails when it is built, as before
+            if hostname:
+                checks.append((name, hostname, f'{fd_name}.azurefd.net.'))
+        return sorted(set(checks))
 
-        if frontend.cert_type != 'FrontDoor' or not frontend.enable_ssl:
-            print('skip DNS config validation when cert type is not front door, or ssl is disabled.')
-            return
-
-        print(f'validating DNS for custom domain {frontend.hostname}')
-        fd_azure_net = f'{frontend.fd_name}.azurefd.net.'
-        print(f'checking {frontend.hostname} mapped to {fd_azure_net}')
-        valid = False
-        try:
-            answer = resolver.resolve(frontend.hostname, rdtype=dns.rdatatype.CNAME)
-            answers = [str(a) for a in answer]
-            print(f'{frontend.hostname} mapped to {", ".join(answers)}')
-            valid = fd_azure_net in answers
-        except:
-            print(f'exception querying {frontend.hostname}')
-            traceback.print_exc()
-
-        if not valid:
-            raise Exception(f'DNS is {"" if valid else "not "}valid for {frontend.hostname}')
+    def cname_target(self):
+        """
+        :return: the cname target a front door managed cert needs, None when the frontend does not use one
+        """
+        if self.enable_ssl and self.cert_type == 'FrontDoor':
+            return f'{self.fd_name}.azurefd.net.'
+        return None
 
-    def __init__(self, cfg, name, fd_name, fd_group):
+    def __init__(self, cfg, name, fd_name, fd_group, state):
         if not cfg:
             raise ValueError('cfg cannot be None')
 
@@ -95,6 +135,8 @@ class Frontend(object):
         self.secret_name = None
         self.secret_version = None
         self.vault_id = None
+        self.vault_name = None
+        self.cname_command = None
         self.fd_name = fd_name
         self.enable_ssl = cfg['enable-ssl'] if 'enable-ssl' in cfg else False
 
@@ -103,10 +145,10 @@ class Frontend(object):
                 raise TypeError('missing frontend host-name config')
             self.hostname = cfg['host-name']
 
-            self.frontdoor_id = self.get_front_door_id(fd_name, fd_group)['id']
+            self.frontdoor_id = state.id
             assert self.frontdoor_id, f'failed to get Frontdoor ID for {fd_name}'
 
-            #create cname here if need to
+            # the cname is created in the apply phase, ahead of the frontend
             create_cname = cfg['create_cname'] if 'create_cname' in cfg else False 
 
             if create_cname:
@@ -115,7 +157,7 @@ class Frontend(object):
                 _zone_group = cfg['zone_group']
                 _cname = self.hostname.split('.')[0]
                 _domain = self.hostname.split(_cname)[1][1:]
-                result = self.create_frontend_cname(_zone_group, _domain, _cname, self.frontdoor_id)
+                self.cname_command = self.create_cname_command(_zone_group, _domain, _cname, self.frontdoor_id)
 
             self.waf = cfg['waf-name'] if 'waf-name' in cfg else None
             self.sticky_sessions = cfg['sticky-sessions'] if 'sticky-sessions' in cfg else False
@@ -130,17 +172,18 @@ class Frontend(object):
                 self.command.extend(['--session-affinity-enabled', 'true'])
                 self.command.extend(['--session-affinity-ttl', str(self.session_ttl)])
             if self.waf:
-                _waf_id = f'/subscriptions/{os.environ["ARM_SUBSCRIPTION_ID"]}/resourceGroups/{fd_group}/providers/Microsoft.Network/frontDoorWebApplicationFirewallPolicies/{self.waf}'
-                self.command.extend(['--waf-policy', _waf_id])
+                self.waf_id = f'/subscriptions/{os.environ["ARM_SUBSCRIPTION_ID"]}/resourceGroups/{fd_group}/providers/Microsoft.Network/frontDoorWebApplicationFirewallPolicies/{self.waf}'
+                self.command.extend(['--waf-policy', self.waf_id])
         else:
             # the hostname is necessary for DNS validation
-            front_end = self.get_frontend(fd_name, fd_group, name)
-            self.hostname = front_end['hostName']
+            front_end = state.frontend(name)
+            # an offline snapshot has no live frontends, only the config is validated
+            assert front_end or state.offline, f'Failed getting frontend {name} in front door {fd_name}'
+            self.hostname = front_end['hostName'] if front_end else None
 
         # HTTPS (we should still allow user to apply SSL if the frontend already exists)
         self.tls_version = cfg['tls-version'] if 'tls-version' in cfg else '1.2'
         self.cert_type = cfg['certificate-type'] if 'certificate-type' in cfg else None
-        self.valid_dns_config_for_fd_cert(self)
         if self.cert_type == 'AzureKeyVault':
             if not 'secret-name' in cfg:
                 raise TypeError('missing secret-name config for certificate-type AzureKeyVault')
@@ -149,25 +192,11 @@ class Frontend(object):
             if not 'vault-id' in cfg:
                 raise TypeError('missing vault-id config for certificate-type AzureKeyVault')
 
-            # the service principal for front door may differ from subscription to subscription
-            fd_sp_object_id = self.get_front_door_sp()['objectId']
-            print(f'configuring access policy for front door service principal with object id {fd_sp_object_id}')
-            _keyvault_name = pathlib.PurePath(f'{cfg["vault-id"]}').name
-            _cmd = ['az', 'keyvault', 'set-policy', '-n', _keyvault_name]
-            # set front door key vault access policy according to:
-            # https://docs.microsoft.com/en-us/azure/frontdoor/front-door-custom-domain-https#grant-azure-front-door-access-to-your-key-vault
-            _cmd.extend(['--certificate-permissions', 'get'])
-            _cmd.extend(['--secret-permissions', 'get'])
-            _cmd.extend(['--object-id', fd_sp_object_id])
-            _result = subprocess.run(_cmd, universal_newlines=True, capture_output=True, timeout=120, text=True)
-            if _result.returncode != 0:
-                print(f'add frontdoor to keyvault access result {_result.returncode}')
-            else:
-                print('success add frontdoor to keyvault access')
-
             self.secret_name = cfg['secret-name']
             self.secret_version = cfg['secret-version']
             self.vault_id = cfg['vault-id']
+            # the front door principal is granted access to the vault in the apply phase
+            self.vault_name = pathlib.PurePath(f'{self.vault_id}').name
 
         self.is_custom_cert = False
 
@@ -189,3 +218,41 @@ class Frontend(object):
                     # do not include the --secret-version parameter to use the Latest version of a secret
                     self.ssl_command.extend(['--secret-version', self.secret_version])
                 self.ssl_command.extend(['--vault-id', self.vault_id])
+
+    def desired(self):
+        """
+        :return: the frontend endpoint properties for a frontend this tool creates, named as in the live frontend
+        """
+        _desired = {
+            'hostName': self.hostname,
+            'sessionAffinityEnabledState': 'Enabled' if self.sticky_sessions else 'Disabled'
+        }
+        if self.sticky_sessions:
+            # as in the cli command, the ttl is only set with affinity, the live value is left alone otherwise
+            _desired['sessionAffinityTtlSeconds'] = self.session_ttl
+        if self.waf:
+            _desired['webApplicationFirewallPolicyLink'] = {'id': self.waf_id}
+        return _desired
+
+    def https_needed(self, state):
+        """
+        :return: True|False if enable-https has to run. The cli is NOT idempotent, it removes and recreates
+        the cert if we just call enable-https, so we check the live config is not already what we want.
+        """
+        if not self.enable_ssl:
+            return False
+
+        if self.is_custom_cert:
+            newssl_config = {
+                "secret_name": self.secret_name,
+                "secret_version": None if 'Latest' == self.secret_version else self.secret_version,
+                "minimum_tls": str(self.tls_version),
+                "vault_id": self.vault_id
+            }
+            return provisioning_needed(state, self.name, newssl_config)
+
+        front_end = state.frontend(self.name) or {}
+        ssl_config = front_end.get('customHttpsConfiguration') or {}
+        if not front_end.get('customHttpsProvisioningState') in ['Enabled', 'Enabling']:
+            return True
+        return ssl_config.get('certificateSource') != self.cert_type or str(ssl_config.get('minimumTlsVersion')) != str(self.tls_version)
@@ -1,7 +1,5 @@
-from routes import Utility as util
-
 class LoadBalancing(object):
-    def __init__(self, cfg, poolname, fd_name, fd_group):
+    def __init__(self, cfg, poolname, fd_name, fd_group, state):
         if not cfg:
             raise ValueError('cfg cannot be None')
         self.action = None
@@ -16,20 +14,12 @@ class LoadBalancing(object):
             self.sample_size = cfg['sample-size'] if 'sample-size' in cfg else self.sample_size
             self.samples = cfg['samples'] if 'samples' in cfg else self.samples
             self.latency = cfg['latency'] if 'latency' in cfg else self.latency
-            self.action = 'show'
-
-            _cmd = ['az', 'network', 'front-door']
-            _cmd.extend(['load-balancing', self.action])
-            _cmd.extend(['--front-door-name', fd_name])
-            _cmd.extend(['--resource-group', fd_group])
-            _cmd.extend(['--name', self.name])
 
-            success, result = util.execute(_cmd)
-            if result and 'does not exist' in result:
+            if not state.loadbalancing(self.name):
                 self.action = 'create'
             else:
                 print(f'loadbalancing {self.name} exists')
-                self.action = None
+                self.action = 'update'
 
             self.command = ['az', 'network', 'front-door']
             self.command.extend(['load-balancing', self.action])
@@ -40,3 +30,12 @@ class LoadBalancing(object):
             self.command.extend(['--successful-samples-required', str(self.samples)])
             self.command.extend(['--additional-latency', str(self.latency)])
 
+    def desired(self):
+        """
+        :return: the load balancing fields we manage, named as in the live load balancing settings
+        """
+        return {
+            'sampleSize': self.sample_size,
+            'successfulSamplesRequired': self.samples,
+            'additionalLatencyMilliseconds': self.latency
+        }
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+from routes import Executor
+from routes import Utility as util
+
+'''
+persistent lookup cache classes
+'''
+class LookupCache(object):
+    '''
+    This keeps the results of read only lookups on disk between runs, one json file per resource, with the
+    resource etag when it has one and an expiry time. A fresh entry is used without a call. An expired entry
+    with an etag is revalidated with the same GET sent with If-None-Match: a 304 (an empty answer) keeps the
+    cached body, anything else replaces it. An expired entry without an etag is fetched again.
+    Any write this run makes to a resource drops the entries of that resource and the resources it is part of,
+    so the next lookup, in this run or the next one, reads it again.
+
+    Entries live in lookups/ under the config cache directory, FDRM_CACHE_DIR or ~/.cache/fdrm, and are kept apart
+    per tenant and subscription of the signed in account, az account show, so an object id or resource read under
+    one login is never served to another. Without an account the lookups are not cached.
+    '''
+    subscription_id = re.compile(r'/subscriptions/[^/?]+', re.IGNORECASE)
+
+    read_verbs = ['show', 'list', 'get', 'get-access-token', 'wait']
+
+    def __init__(self, directory: str = None, enabled: bool = True):
+        base = directory or os.environ.get('FDRM_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'fdrm')
+        self.directory = os.path.join(base, 'lookups')
+        self.enabled = enabled
+        self._scope = None
+        self._scope_lock = threading.Lock()
+
+    def scope(self):
+        """
+        :return: 'tenant|subscription' of the signed in account, read once per run, '' when az cannot tell
+        """
+        with self._scope_lock:
+            if self._scope is None:
+                result = util.run(['az', 'account', 'show', '--query', '{tenantId:tenantId,id:id}', '-o', 'json'])
+                try:
+                    account = json.loads(result.stdout) if result.returncode == 0 else {}
+                except ValueError:
+                    account = {}
+                self._scope = f'{account["tenantId"]}|{account["id"]}' if account.get('tenantId') and account.get('id') else ''
+                if not self._scope:
+                    print(f'lookup cache not used, no signed in account\n{result.stderr}')
+            return self._scope
+
+    @classmethod
+    def resource(cls, key: str):
+        """
+        :return: the key in the form entries are compared in, lower case and with the subscription id masked
+        """
+        return cls.subscription_id.sub('/subscriptions/*', key.split('?')[0].lower().rstrip('/'))
+
+    def path(self, key: str):
+        scope = f'{self.scope()}|{self.resource(key)}'
+        return os.path.join(self.directory, hashlib.sha256(scope.encode('utf-8')).hexdigest() + '.json')
+
+    def read(self, key: str):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key: str, stdout: str, etag: str, ttl: int):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write then rename, a concurrent run never reads a partial entry
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as f:
+                json.dump({'key': self.resource(key), 'etag': etag, 'expires': time.time() + ttl, 'stdout': stdout}, f)
+            os.replace(f.name, self.path(key))
+        except OSError as e:
+            print(f'lookup cache not written: {str(e)}')
+
+    def lookup(self, key: str, command: list, runner, ttl: int = 0, etag: bool = False):
+        """
+        :param key: resource id or name the command reads
+        :param runner: runs the command, Utility.run
+        :param etag: the command is an az rest GET whose json answer carries an etag
+        :return: subprocess.CompletedProcess, the cached output when the entry is fresh or unchanged
+        """
+        if not self.enabled or not self.scope():
+            return runner(command)
+
+        entry = self.read(key)
+        if entry and entry['expires'] > time.time():
+            return subprocess.CompletedProcess(command, 0, entry['stdout'], '')
+
+        _command = command
+        if entry and entry['etag']:
+            _command = command + ['--headers', f'If-None-Match={entry["etag"]}']
+        result = runner(_command)
+        if result.returncode != 0:
+            return result
+
+        if entry and entry['etag'] and not (result.stdout or '').strip():
+            # 304 not modified
+            self.write(key, entry['stdout'], entry['etag'], ttl)
+            return subprocess.CompletedProcess(command, 0, entry['stdout'], result.stderr)
+
+        _etag = None
+        if etag:
+            try:
+                _etag = json.loads(result.stdout).get('etag')
+            except (ValueError, AttributeError):
+                pass
+        self.write(key, result.stdout, _etag, ttl)
+        return result
+
+    def written(self, command: list):
+        """
+        :return: the resource key a write command changes, None for reads
+        """
+        if command[:2] == ['az', 'rest']:
+            method = command[command.index('--method') + 1].lower() if '--method' in command else 'get'
+            if method == 'get' or not '--url' in command:
+                return None
+            return command[command.index('--url') + 1]
+
+        verbs = []
+        for arg in command[1:]:
+            if arg.startswith('-'):
+                break
+            verbs.append(arg)
+        if not verbs or verbs[-1] in self.read_verbs:
+            return None
+
+        flag = lambda *names: next((command[command.index(n) + 1] for n in names if n in command and command.index(n) + 1 < len(command)), None)
+        if verbs[:2] == ['network', 'front-door']:
+            fd_name = flag('--front-door-name', '-f') or (flag('--name', '-n') if len(verbs) == 3 else None)
+            fd_group = flag('--resource-group', '-g')
+            if fd_name and fd_group:
+                return f'/subscriptions/*/resourceGroups/{fd_group}/providers/Microsoft.Network/frontDoors/{fd_name}'
+        return None
+
+    def invalidate(self, key: str):
+        ''' drop the entries of the resource and of every resource it is part of, a rules engine write changes its front door '''
+        if not self.enabled or not self.scope():
+            return
+        parts = self.resource(key).split('/')
+        for depth in range(1, len(parts) + 1):
+            try:
+                os.remove(self.path('/'.join(parts[:depth])))
+            except OSError:
+                pass
+
+
+class InvalidatingExecutor(Executor.Executor):
+    '''
+    drops the cached lookups of every resource a command writes, a failed write may have changed it too
+    '''
+    def __init__(self, executor: Executor.Executor, cache: LookupCache):
+        self.executor = executor
+        self.cache = cache
+
+    def run(self, command: list, timeout: int = None):
+        result = self.executor.run(command, timeout)
+        key = self.cache.written(command)
+        if key:
+            self.cache.invalidate(key)
+        return result
+
+    def close(self):
+        self.executor.close()
+
+
+_cache = LookupCache(enabled=False)
+
+def set_cache(cache: LookupCache):
+    global _cache
+    _cache = cache
+
+def get():
+    return _cache
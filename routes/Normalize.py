@@ -0,0 +1,52 @@
+import hashlib
+import json
+
+'''
+config normalization functions
+'''
+
+def canonical(fragment):
+    """
+    :return: canonical json text of a config fragment, the same config in any key order gives the same text
+    """
+    return json.dumps(fragment, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def fingerprint(fragment):
+    """
+    :return: sha256 hex digest of the canonical config fragment
+    """
+    return hashlib.sha256(canonical(fragment).encode('utf-8')).hexdigest()
+
+
+def unique(fragments: list):
+    """
+    :return: the fragments with duplicates dropped, in first seen order, one hash lookup per fragment
+    """
+    seen = set()
+    _unique = []
+    for fragment in fragments or []:
+        key = fingerprint(fragment)
+        if not key in seen:
+            seen.add(key)
+            _unique.append(fragment)
+    return _unique
+
+
+class Registry(object):
+    '''
+    This holds one model instance per distinct config fragment. Routes that declare the same frontend, backend
+    pool, probe or load balancing block get the instance built for the first one, so its lookups, side effects
+    and writes happen once per run.
+    '''
+    def __init__(self):
+        self.instances = {}
+
+    def get(self, kind: str, fragment, build):
+        """
+        :return: the instance for this kind and fragment, calling build() only the first time it is seen
+        """
+        key = (kind, fingerprint(fragment))
+        if not key in self.instances:
+            self.instances[key] = build()
+        return self.instances[key]
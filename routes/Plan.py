@@ -0,0 +1,196 @@
+import json
+import os
+import tempfile
+import threading
+
+from routes import Utility as util
+from routes import Scheduler
+from routes import Trace
+
+'''
+desired state plan classes
+'''
+class Operation(object):
+    '''
+    This represents one write against the front door, a create, update or delete of a single resource.
+    changes lists the fields that differ from the live resource, empty for creates and deletes.
+    '''
+    def __init__(self, action: str, kind: str, name: str, command: list, fatal: bool = True, changes: list = None, record: str = None, wait=None, after: list = None, on_success=None, query: str = None, body: dict = None, check=None):
+        if not action in ['create', 'update', 'delete']:
+            raise ValueError(f'unknown plan action {action}')
+        if not command:
+            raise ValueError(f'{action} {kind} {name} command cannot be empty')
+        self.action = action
+        self.kind = kind
+        self.name = name
+        self.command = command
+        self.fatal = fatal
+        self.changes = changes or []
+        self.record = record   # State index to record the command result into
+        self.wait = wait       # optional callable returning (result, status) to run after the command succeeds
+        self.after = [op for op in after or [] if op is not None]   # operations that must finish before this one starts
+        self.on_success = on_success   # optional callable to hand the resource off once the command succeeds, must not block
+        self.query = query     # --query projection of the output to record, the state index only needs the name and id
+        self.body = body       # request body of an az rest write, passed with --body @file while the command runs
+        self.check = check     # optional callable run just before the command, raises to stop the write
+
+    def output_args(self):
+        """
+        :return: the output arguments for the command, a projection when the result is recorded, no output otherwise
+        """
+        if '-o' in self.command or '--output' in self.command or '--query' in self.command:
+            return []
+        if self.record:
+            return ['--query', self.query or '{name:name,id:id}']
+        return ['--output', 'none']
+
+    def describe(self):
+        _changes = f' ({", ".join(self.changes)})' if self.changes else ''
+        return f'{self.action} {self.kind} {self.name}{_changes}'
+
+
+class Plan(object):
+    '''
+    This represents the ordered set of writes needed to make the front door match the config.
+    Resources that already match produce no operation, so a re-run of an unchanged config makes no writes.
+    '''
+
+    # trace phase of each operation kind
+    phases = {
+        'frontend': 'frontend', 'dns cname': 'frontend', 'cert provisioning': 'cert', 'key vault access': 'cert',
+        'probe': 'pool', 'load balancing': 'pool', 'pool': 'pool', 'pool backends': 'pool',
+        'routing rule': 'rule', 'engine association': 'association',
+        'rules engine': 'engine', 'engine rule': 'engine', 'engine rule item': 'engine', 'engine rule action': 'engine', 'engine rule condition': 'engine',
+        'front door': 'document', 'front door links': 'document'
+    }
+
+    # az writes these by reading the whole front door, changing it and putting it back without an etag, two of them
+    # at once on one front door lose a change or fail, so they run one at a time. Rules engines are their own
+    # resources, dns, key vault and the cert provisioning action do not write the front door, those run in parallel.
+    front_door_writes = ['frontend', 'probe', 'load balancing', 'pool', 'pool backends', 'routing rule', 'engine association',
+                         'front door', 'front door links']
+
+    def __init__(self, state):
+        self.state = state
+        self.operations = []
+        self._planned = {}
+
+    def planned(self, kind: str, name: str):
+        """
+        :return: True|False if a create or update for the resource is already in this plan
+        """
+        return (kind, name.lower()) in self._planned
+
+    def find(self, kind: str, name: str):
+        """
+        :return: the planned create or update Operation for a resource, None if the resource is not written by this plan
+        """
+        if not name:
+            return None
+        return self._planned.get((kind, name.lower()))
+
+    def add(self, operation: Operation):
+        """
+        :return: the Operation kept in the plan. The same resource can be referenced by more than one route,
+        only the first write for it is kept and returned so callers can still depend on it.
+        Two different definitions under one name are a config conflict and raise ValueError.
+        """
+        key = (operation.kind, operation.name.lower())
+        if operation.action != 'delete':
+            if key in self._planned:
+                planned = self._planned[key]
+                if planned.command != operation.command or planned.body != operation.body:
+                    raise ValueError(f'{operation.kind} {operation.name} is defined more than once with different settings:\n'
+                                     f'  {" ".join(planned.command)}\n  {" ".join(operation.command)}')
+                planned.after.extend(op for op in operation.after if not op in planned.after)
+                return planned
+            self._planned[key] = operation
+        self.operations.append(operation)
+        return operation
+
+    def reconcile(self, kind: str, name: str, desired: dict, live: dict, command: list, fatal: bool = True, record: str = None, after: list = None):
+        """
+        :return: a create Operation when the resource does not exist, an update Operation when any desired field
+        differs from the live resource, otherwise None
+        """
+        if not live:
+            return self.add(Operation('create', kind, name, command, fatal, record=record, after=after))
+        changes = util.changed_fields(desired, live)
+        if changes:
+            return self.add(Operation('update', kind, name, command, fatal, changes, record, after=after))
+        return None
+
+    def summary(self):
+        counts = {'create': 0, 'update': 0, 'delete': 0}
+        for op in self.operations:
+            counts[op.action] += 1
+        return f'{counts["create"]} to create, {counts["update"]} to update, {counts["delete"]} to delete'
+
+    def show(self, verbose: bool = False):
+        for op in self.operations:
+            print(f'  {op.describe()}')
+            if verbose: print(f'    {" ".join(op.command)}')
+        print(f'plan: {self.summary()}')
+
+    def execute(self, verbose: bool = False, veryverbose: bool = False, parallelism: int = 1):
+        """
+        :return: 0 on success, 1 if a non fatal step such as cert provisioning did not complete
+        """
+        status = [0]
+        lock = threading.Lock()
+        front_door_lock = threading.Lock()
+
+        def work(op):
+            with Trace.span(op.describe(), phase=self.phases.get(op.kind), kind=op.kind, resource=op.name):
+                run(op)
+
+        def run(op):
+            print(f'{op.describe()}, please wait ...')
+            command = op.command + op.output_args()
+            body = None
+            if op.body is not None:
+                # the body file only exists while the command runs, planning writes nothing to disk
+                with tempfile.NamedTemporaryFile('w', prefix='fdrm-', suffix='.json', delete=False) as body:
+                    json.dump(op.body, body)
+                command.extend(['--body', f'@{body.name}'])
+            if verbose: print(f'{" ".join(command)}')
+            def apply():
+                if op.check:
+                    op.check()
+                return util.execute(command, parse=bool(op.record))
+
+            try:
+                if op.kind in self.front_door_writes:
+                    with front_door_lock:
+                        success, result = apply()
+                else:
+                    success, result = apply()
+            finally:
+                if body:
+                    os.remove(body.name)
+            if not success:
+                print(f'{op.describe()} command returned with:\n{result}')
+                if op.fatal and not (op.action == 'create' and 'already exists' in str(result)):
+                    raise RuntimeError(f'failed to {op.action} {op.kind} {op.name}')
+                return
+            if veryverbose: print(result)
+            if op.record and result:
+                with lock:
+                    self.state.record(op.record, result)
+
+            if op.on_success:
+                op.on_success()
+
+            if op.wait:
+                with Trace.span(f'wait {op.kind}', 'wait') as _span:
+                    result, wait_status = op.wait()
+                    _span['status'] = wait_status
+                if result:
+                    print(f'\n*** {op.kind} for {op.name} succeeded with status {wait_status} ***\n')
+                else:
+                    print(f'\n*** {op.kind.upper()} FOR {op.name} FAILED with status {wait_status} ***\n')
+                    with lock:
+                        status[0] = 1
+
+        Scheduler.Scheduler(self.operations, parallelism).run(work)
+        return status[0]
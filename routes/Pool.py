@@ -1,18 +1,19 @@
 import json
 from routes import Probe
 from routes import LoadBalancing
-from routes import Utility as util
+from routes import Normalize
 
 '''
 backend pool class
 '''
 class Pool(object):
-    def __init__(self, cfg, fd_name, fd_group):
+    def __init__(self, cfg, fd_name, fd_group, state, registry=None):
         if not cfg:
             raise ValueError('cfg cannot be None')
+        registry = registry or Normalize.Registry()
 
         self.name = None
-        _config = json.loads(json.dumps(cfg))
+        _config = cfg
         for k,v in _config.items():
             if not self.name: self.name = k
         self.create_pool = not _config[self.name]['exists'] if 'exists' in _config[self.name] else False
@@ -32,22 +33,21 @@ class Pool(object):
             self.weight = self.pool_cfg['weight'] if 'weight' in self.pool_cfg else 50
             self.probe = None
             if 'probe' in self.pool_cfg and self.pool_cfg['probe']:
-                self.probe = Probe.Probe(self.pool_cfg['probe'], self.name, fd_name, fd_group)
+                _cfg = self.pool_cfg['probe']
+                # without a name the probe is named after the pool, the same block in another pool is another probe
+                self.probe = registry.get('probe', [_cfg.get('name') or f'probe-{self.name}', _cfg],
+                                          lambda: Probe.Probe(_cfg, self.name, fd_name, fd_group, state))
 
             self.loadbalancing = None
             if 'load-balancing' in self.pool_cfg and self.pool_cfg['load-balancing']:
-                self.loadbalancing = LoadBalancing.LoadBalancing(self.pool_cfg['load-balancing'], self.name, fd_name, fd_group)
+                _cfg = self.pool_cfg['load-balancing']
+                self.loadbalancing = registry.get('load balancing', [_cfg.get('name') or f'lb-{self.name}', _cfg],
+                                                  lambda: LoadBalancing.LoadBalancing(_cfg, self.name, fd_name, fd_group, state))
 
-            self.action = 'show'
-            self.command = ['az', 'network', 'front-door']
-            self.command.extend(['backend-pool', self.action])
-            self.command.extend(['--front-door-name', fd_name])
-            self.command.extend(['--resource-group', fd_group])
-            self.command.extend(['--name', self.name])
+            self.action = None
+            self.command = []
 
-            success, result = util.execute(self.command)
-
-            if not success or 'Not Found' in result:
+            if not state.pool(self.name):
                 self.action = 'create'
                 self.command = ['az', 'network', 'front-door']
                 self.command.extend(['backend-pool', self.action])
@@ -57,12 +57,64 @@ class Pool(object):
                 self.command.extend(['--probe', self.probe.name])
                 self.command.extend(['--load-balancing', self.loadbalancing.name])
 
-                self.command.extend(['--address', next(iter(self.backends[0]))]) #if len(self.backends) > 1, need to update backend after creating it
-                if 'host-header' in self.backends[0] and self.backends[0]["host-header"]:
-                    self.command.extend(['--backend-host-header', self.backends[0]["host-header"]])
-
-                self.command.extend(['--http-port', str(self.http_port)])
-                self.command.extend(['--https-port', str(self.https_port)])
-                self.command.extend(['--priority', str(self.priority)])
-                self.command.extend(['--weight', str(self.weight)])
+                # the create command only takes one backend, the full list is set by the update command after it
+                _first = self.backend(self.backends[0])
+                self.command.extend(['--address', _first['address']])
+                self.command.extend(['--backend-host-header', _first['backendHostHeader']])
+                self.command.extend(['--http-port', str(_first['httpPort'])])
+                self.command.extend(['--https-port', str(_first['httpsPort'])])
+                self.command.extend(['--priority', str(_first['priority'])])
+                self.command.extend(['--weight', str(_first['weight'])])
                 self.command.extend(['--disabled', 'false'])
+
+            _desired = self.desired()
+            self.update_command = ['az', 'network', 'front-door']
+            self.update_command.extend(['backend-pool', 'update'])
+            self.update_command.extend(['--front-door-name', fd_name])
+            self.update_command.extend(['--resource-group', fd_group])
+            self.update_command.extend(['--name', self.name])
+            self.update_command.extend(['--set', f'backends={json.dumps(_desired["backends"])}',
+                                        f'healthProbeSettings.id={state.id}/healthProbeSettings/{self.probe.name}',
+                                        f'loadBalancingSettings.id={state.id}/loadBalancingSettings/{self.loadbalancing.name}'])
+
+    def backend(self, endpoint: dict):
+        """
+        :return: one backend as it appears in the live pool, host-header, priority, weight, ports and disable
+        can be set per backend and default to the pool config
+        """
+        _address = next(iter(endpoint))
+        return {
+            'address': _address,
+            'backendHostHeader': endpoint['host-header'] if 'host-header' in endpoint and endpoint['host-header'] else _address,
+            'httpPort': endpoint['http-port'] if 'http-port' in endpoint else self.http_port,
+            'httpsPort': endpoint['https-port'] if 'https-port' in endpoint else self.https_port,
+            'priority': endpoint['priority'] if 'priority' in endpoint else self.priority,
+            'weight': endpoint['weight'] if 'weight' in endpoint else self.weight,
+            'enabledState': 'Disabled' if 'disable' in endpoint and endpoint['disable'] else 'Enabled'
+        }
+
+    def created(self):
+        """
+        :return: the pool as the create command leaves it, with only the first backend
+        """
+        _created = self.desired()
+        _created['backends'] = _created['backends'][:1]
+        return _created
+
+    def desired(self):
+        """
+        :return: the backend pool properties, named as in the live backend pool
+        """
+        _backends = []
+        _seen = []
+        for endpoint in self.backends:
+            # a backend listed twice would only collect a stale duplicate in the pool
+            if next(iter(endpoint)).lower() in _seen:
+                continue
+            _seen.append(next(iter(endpoint)).lower())
+            _backends.append(self.backend(endpoint))
+        return {
+            'backends': _backends,
+            'healthProbeSettings': {'id': self.probe.name},
+            'loadBalancingSettings': {'id': self.loadbalancing.name}
+        }
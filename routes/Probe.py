@@ -1,8 +1,6 @@
-from routes import Utility as util
-
 class Probe(object):
 
-    def __init__(self, cfg, poolname, fd_name, fd_group):
+    def __init__(self, cfg, poolname, fd_name, fd_group, state):
         if not cfg:
             raise ValueError('cfg cannot be None')
         self.action = None
@@ -15,18 +13,10 @@ class Probe(object):
             self.name = cfg['name'] #must exist
             self.command = []
         else:
-            self.action = 'show'
             self.interval = cfg['interval'] if 'interval' in cfg else self.interval
             self.protocol = cfg['protocol'] if 'protocol' in cfg else self.protocol
             self.path = cfg['path'] if 'path' in cfg else self.path
-            _cmd = ['az', 'network', 'front-door']
-            _cmd.extend(['probe', self.action])
-            _cmd.extend(['--front-door-name', fd_name])
-            _cmd.extend(['--resource-group', fd_group])
-            _cmd.extend(['--name', self.name])
-
-            success, result = util.execute(_cmd)
-            if result and 'does not exist' in result:
+            if not state.probe(self.name):
                 self.action = 'create'
             else:
                 print(f'probe {self.name} exists')
@@ -38,9 +28,19 @@ class Probe(object):
             self.command.extend(['--resource-group', fd_group])
             self.command.extend(['--name', self.name])
             self.command.extend(['--protocol', self.protocol])
-            if self.disable:
-                self.command.extend(['--enabled', 'Disabled'])
+            self.command.extend(['--enabled', 'Disabled' if self.disable else 'Enabled'])
             self.command.extend(['--interval', str(self.interval)])
             self.command.extend(['--path', self.path])
             self.command.extend(['--probeMethod', "GET"])
 
+    def desired(self):
+        """
+        :return: the probe fields we manage, named as in the live health probe settings
+        """
+        return {
+            'path': self.path,
+            'protocol': self.protocol,
+            'intervalInSeconds': self.interval,
+            'healthProbeMethod': 'GET',
+            'enabledState': 'Disabled' if self.disable else 'Enabled'
+        }
@@ -4,6 +4,8 @@ class Rule(object):
             raise ValueError('cfg cannot be None')
         self.action = None
         self.name = name
+        self.pool = pool
+        self.frontend_names = frontend_names
         self.ruletype = cfg['ruletype'] if 'ruletype' in cfg else 'Forward'
 
         if self.ruletype and not self.ruletype == 'None':
@@ -56,3 +58,38 @@ class Rule(object):
                 if self.dest_path:
                     self.command.extend(['--custom-path', self.dest_path])
 
+    def desired(self):
+        """
+        :return: the routing rule fields we manage, named as in the live routing rule
+        """
+        _desired = {
+            'enabledState': 'Disabled' if self.disable_rule else 'Enabled',
+            'frontendEndpoints': [{'id': fe} for fe in self.frontend_names],
+            'patternsToMatch': self.patterns,
+            'acceptedProtocols': self.protocols
+        }
+        if self.ruletype == 'Forward':
+            _desired['routeConfiguration'] = {
+                'backendPool': {'id': self.pool},
+                'forwardingProtocol': self.forward_protocol,
+                'customForwardingPath': self.forward_path
+            }
+        else:
+            _desired['routeConfiguration'] = {
+                'redirectType': self.redirect_type,
+                'redirectProtocol': self.redirect_protocol,
+                'customHost': self.dest_host,
+                'customPath': self.dest_path
+            }
+        return _desired
+
+    def compile(self):
+        """
+        :return: the routing rule properties as arm json for a front door PUT
+        """
+        _compiled = self.desired()
+        if self.ruletype == 'Forward':
+            _compiled['routeConfiguration']['@odata.type'] = '#Microsoft.Azure.FrontDoor.Models.FrontdoorForwardingConfiguration'
+        else:
+            _compiled['routeConfiguration']['@odata.type'] = '#Microsoft.Azure.FrontDoor.Models.FrontdoorRedirectConfiguration'
+        return _compiled
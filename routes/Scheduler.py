@@ -0,0 +1,62 @@
+import concurrent.futures
+
+'''
+dependency graph scheduler class
+'''
+class Scheduler(object):
+    '''
+    This runs plan operations as a dependency graph on a bounded worker pool. An operation starts once every
+    operation in its after list has finished, so independent routes and rules engines do not wait on each other.
+    With parallelism 1 operations run one at a time in plan order, the same as a plain loop.
+    If an operation raises, nothing new is started, the running operations are allowed to finish and the
+    first exception is raised again to the caller.
+    '''
+    def __init__(self, operations: list, parallelism: int = 1):
+        if parallelism < 1:
+            raise ValueError('parallelism must be at least 1')
+        self.operations = operations
+        self.parallelism = parallelism
+
+        _ids = {id(op) for op in operations}
+        self.waiting = {}
+        self.dependents = {id(op): [] for op in operations}
+        for op in operations:
+            deps = {id(d) for d in op.after if d is not None and id(d) in _ids and d is not op}
+            self.waiting[id(op)] = deps
+            for d in deps:
+                self.dependents[d].append(op)
+
+    def run(self, work):
+        '''
+        call work(operation) for every operation, respecting the dependency edges
+        '''
+        order = {id(op): index for index, op in enumerate(self.operations)}
+        ready = [op for op in self.operations if not self.waiting[id(op)]]
+        running = {}
+        error = None
+        done = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            while ready or running:
+                while ready and not error and len(running) < self.parallelism:
+                    op = ready.pop(0)
+                    running[pool.submit(work, op)] = op
+                if not running:
+                    break
+
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    op = running.pop(future)
+                    done += 1
+                    if future.exception() and not error:
+                        error = future.exception()
+                    for dependent in self.dependents[id(op)]:
+                        self.waiting[id(dependent)].discard(id(op))
+                        if not self.waiting[id(dependent)]:
+                            ready.append(dependent)
+                ready.sort(key=lambda o: order[id(o)])
+
+        if error:
+            raise error
+        if done < len(self.operations):
+            raise RuntimeError('plan has a dependency cycle, some operations never became ready')
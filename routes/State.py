@@ -0,0 +1,119 @@
+from routes import Document
+
+'''
+front door state snapshot class
+'''
+class State(object):
+    '''
+    This represents the live configuration of one front door, fetched with a single bulk lookup at startup.
+    Model constructors query this instead of running their own az show/list commands per object.
+    Azure resource names are case insensitive, so every index is keyed by the lower cased name.
+    '''
+
+    kinds = ['frontendEndpoints', 'backendPools', 'healthProbeSettings', 'loadBalancingSettings', 'routingRules', 'rulesEngines']
+
+    _snapshots = {}
+
+    @classmethod
+    def load(cls, fd_name: str, fd_group: str, refresh: bool = False):
+        """
+        :return: the State for a given frontdoor, fetched once per run unless refresh is True
+        """
+        key = (fd_name.lower(), fd_group.lower())
+        if refresh or not key in cls._snapshots:
+            cls._snapshots[key] = cls(fd_name, fd_group)
+        return cls._snapshots[key]
+
+    @classmethod
+    def flatten(cls, item: dict):
+        """
+        :return: the resource with any arm 'properties' block merged into the top level, the same shape the az cli prints
+        """
+        if not isinstance(item, dict) or not 'properties' in item:
+            return item
+        flat = {k: v for k, v in item.items() if k != 'properties'}
+        flat.update(item['properties'] or {})
+        return flat
+
+    @classmethod
+    def fetch(cls, fd_name: str, fd_group: str):
+        """
+        :return: the full front door document, including rules engines
+        """
+        # arm lookups, the same get the document apply mode sends, so the arm executor answers them in process
+        return cls.flatten(Document.Document.fetch(fd_name, fd_group))
+
+    @classmethod
+    def empty(cls, fd_name: str, fd_group: str):
+        """
+        :return: an offline State with no live resources, nothing is fetched. Models built from it only validate the config.
+        """
+        _id = f'/subscriptions/{{subscriptionId}}/resourceGroups/{fd_group}/providers/Microsoft.Network/frontDoors/{fd_name}'
+        state = cls(fd_name, fd_group, {'id': _id, 'name': fd_name, 'properties': {}})
+        state.offline = True
+        return state
+
+    def __init__(self, fd_name: str, fd_group: str, document: dict = None):
+        self.fd_name = fd_name
+        self.fd_group = fd_group
+        self.offline = False
+        self.document = self.flatten(document) if document else self.fetch(fd_name, fd_group)
+        self.id = self.document.get('id')
+        self.resources = {}
+        for kind in self.kinds:
+            self.resources[kind] = {}
+            for item in self.document.get(kind) or []:
+                self.record(kind, item)
+
+    def record(self, kind: str, item: dict):
+        '''
+        index a resource, also used to keep the snapshot current after this run creates or updates something
+        '''
+        item = self.flatten(item)
+        if not isinstance(item, dict) or not item.get('name'):
+            return
+        self.resources[kind][item['name'].lower()] = item
+
+    def get(self, kind: str, name: str):
+        """
+        :return: the live resource dictionary or None if it does not exist
+        """
+        if not name:
+            return None
+        return self.resources[kind].get(name.lower())
+
+    def frontend(self, name: str):
+        return self.get('frontendEndpoints', name)
+
+    def pool(self, name: str):
+        return self.get('backendPools', name)
+
+    def probe(self, name: str):
+        return self.get('healthProbeSettings', name)
+
+    def loadbalancing(self, name: str):
+        return self.get('loadBalancingSettings', name)
+
+    def routing_rule(self, name: str):
+        return self.get('routingRules', name)
+
+    def engine(self, name: str):
+        return self.get('rulesEngines', name)
+
+    def engine_rules(self, engine: str):
+        """
+        :return: dict of rule name to rule dictionary for a given rules engine, in engine order
+        """
+        _engine = self.engine(engine)
+        if not _engine:
+            return {}
+        return {r['name']: r for r in _engine.get('rules') or []}
+
+    def engine_rule(self, engine: str, rule: str):
+        """
+        :return: the rule dictionary or None if the engine or rule does not exist
+        """
+        for k, v in self.engine_rules(engine).items():
+            if k.lower() == rule.lower():
+                return v
+        return None
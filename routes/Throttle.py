@@ -0,0 +1,173 @@
+import os
+import random
+import re
+import threading
+import time
+
+from routes import Executor
+
+'''
+throttling aware executor classes
+'''
+class TokenBucket(object):
+    '''
+    rate tokens per second refill up to burst, take() blocks until a token is available
+    '''
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        ''' the service said slow down, spend what is left so the next calls wait for the refill '''
+        with self._lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+class AdaptiveLimit(object):
+    '''
+    This caps the calls in flight. The cap halves on every throttled response and grows back by one after
+    a run of successful calls, so concurrency settles just below where the service starts throttling.
+    '''
+    def __init__(self, limit: int, ceiling: int, grow_after: int = 10):
+        self.limit = max(1, limit)
+        self.ceiling = max(self.limit, ceiling)
+        self.grow_after = grow_after
+        self.active = 0
+        self.successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, throttled: bool):
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.successes = 0
+                if self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    print(f'throttled, lowering concurrency to {self.limit}')
+            else:
+                self.successes += 1
+                if self.successes >= self.grow_after and self.limit < self.ceiling:
+                    self.successes = 0
+                    self.limit += 1
+            self._cond.notify_all()
+
+
+class ThrottledExecutor(Executor.Executor):
+    '''
+    This wraps the selected executor so every az and management api call of the run shares one rate limiter.
+    Calls are classed as reads or writes per subscription, each class has its own token bucket and adaptive
+    concurrency limit. A throttled call (429, TooManyRequests) is retried after its Retry-After, or with jittered
+    exponential backoff when the service gives none. A throttled request was not processed, so writes are
+    retried too.
+
+    The defaults follow the arm limits per subscription and principal: reads refill 25 per second up to 250,
+    writes refill 10 per second up to 200.
+    '''
+    # only the status and error code forms, a resource name or id containing 429 is not throttling
+    throttled = re.compile(r'\(429\)|TooManyRequests|Too Many Requests', re.IGNORECASE)
+    retry_after = re.compile(r'retry[- ]after\D{0,3}(\d+)', re.IGNORECASE)
+    subscription_id = re.compile(r'/subscriptions/([^/?{]+)', re.IGNORECASE)
+
+    read_verbs = ['show', 'list', 'get', 'get-access-token', 'wait']
+
+    def __init__(self, executor: Executor.Executor, concurrency: int = 4, read_rate: float = 25, read_burst: int = 250,
+                 write_rate: float = 10, write_burst: int = 200, max_retries: int = 6, backoff: float = 2, max_backoff: float = 60):
+        self.executor = executor
+        self.concurrency = concurrency
+        self.rates = {'read': (read_rate, read_burst), 'write': (write_rate, write_burst)}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {}
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def classify(self, command: list):
+        """
+        :return: (subscription, read|write) for the command
+        """
+        subscription = None
+        if '--subscription' in command and command.index('--subscription') + 1 < len(command):
+            subscription = command[command.index('--subscription') + 1]
+        else:
+            for arg in command:
+                match = self.subscription_id.search(arg)
+                if match:
+                    subscription = match.group(1)
+                    break
+        subscription = (subscription or os.environ.get('ARM_SUBSCRIPTION_ID') or 'default').lower()
+
+        if command[:2] == ['az', 'rest']:
+            method = command[command.index('--method') + 1].lower() if '--method' in command else 'get'
+            return subscription, 'read' if method == 'get' else 'write'
+        verbs = []
+        for arg in command[1:]:
+            if arg.startswith('-'):
+                break
+            verbs.append(arg)
+        return subscription, 'read' if verbs and verbs[-1] in self.read_verbs else 'write'
+
+    def limiter(self, key: tuple):
+        with self._lock:
+            if not key in self.buckets:
+                rate, burst = self.rates[key[1]]
+                self.buckets[key] = TokenBucket(rate, burst)
+                # reads are short lookups and polls, let more of them run at once than writes
+                limit = self.concurrency * 4 if key[1] == 'read' else self.concurrency
+                self.limits[key] = AdaptiveLimit(limit, limit * 2)
+            return self.buckets[key], self.limits[key]
+
+    def delay(self, attempt: int, stderr: str):
+        """
+        :return: seconds to wait before the next attempt, the Retry-After the service sent when there is one
+        """
+        match = self.retry_after.search(stderr or '')
+        if match:
+            return int(match.group(1)) + random.uniform(0, 1)
+        _delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return _delay / 2 + random.uniform(0, _delay / 2)
+
+    def run(self, command: list, timeout: int = None):
+        bucket, limit = self.limiter(self.classify(command))
+        attempt = 0
+        while True:
+            bucket.take()
+            limit.acquire()
+            result = None
+            try:
+                result = self.executor.run(command, timeout)
+            finally:
+                _throttled = result is not None and result.returncode != 0 and bool(self.throttled.search(result.stderr or ''))
+                limit.release(_throttled)
+            if not _throttled or attempt >= self.max_retries:
+                return result
+            bucket.drain()
+            _delay = self.delay(attempt, result.stderr)
+            attempt += 1
+            print(f'throttled running {" ".join(command[:6])} ..., retry {attempt} of {self.max_retries} in {_delay:.1f}s')
+            time.sleep(_delay)
+
+    def close(self):
+        self.executor.close()
@@ -0,0 +1,145 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from routes import Executor
+
+'''
+timing trace classes
+'''
+class Tracer(object):
+    '''
+    This records spans: every azure call, plan step, lookup and wait, with start and end time, phase
+    (state, frontend, cert, pool, rule, engine, association, document), resource kind and name, and for calls the
+    exit status and bytes of output. Spans started inside another span on the same thread inherit its phase, kind
+    and resource, so a call knows which step made it.
+    With a path prefix, spans are appended to <prefix>.jsonl as they finish and <prefix>.json is written at the end
+    in the chrome trace format (chrome://tracing, perfetto). A disabled tracer records nothing.
+    '''
+    def __init__(self, prefix: str = None):
+        self.enabled = prefix is not None
+        self.prefix = prefix
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._lines = open(f'{prefix}.jsonl', 'w') if self.enabled else None
+
+    def current(self):
+        return getattr(self._local, 'context', {})
+
+    @contextlib.contextmanager
+    def span(self, name: str, type: str = 'step', phase: str = None, kind: str = None, resource: str = None, **args):
+        '''
+        time the block, the yielded dict is recorded with the span so the block can add status and sizes
+        '''
+        if not self.enabled:
+            yield args
+            return
+        outer = self.current()
+        context = {'phase': phase or outer.get('phase'), 'kind': kind or outer.get('kind'), 'resource': resource or outer.get('resource')}
+        self._local.context = context
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self._local.context = outer
+            self.record(name, type, start, time.perf_counter(), args=args, **context)
+
+    def record(self, name: str, type: str, start: float, end: float, phase: str = None, kind: str = None, resource: str = None, args: dict = None):
+        ''' add a finished span, start and end are time.perf_counter() values '''
+        if not self.enabled:
+            return
+        span = {
+            'name': name, 'type': type, 'phase': phase or 'other', 'kind': kind, 'resource': resource,
+            'start': round(self.started + start - self.origin, 6), 'duration': round(end - start, 6),
+            'thread': threading.current_thread().name, 'args': args or {}
+        }
+        with self._lock:
+            self.spans.append(span)
+            self._lines.write(json.dumps(span, default=str) + '\n')
+            self._lines.flush()
+
+    def summary(self):
+        ''' print time per phase and per resource kind, calls are the azure invocations, steps the plan writes and lookups '''
+        if not self.enabled or not self.spans:
+            return
+        for field in ['phase', 'kind']:
+            totals = {}
+            for s in self.spans:
+                _total = totals.setdefault(s[field] or 'other', {'call': [0, 0.0], 'step': [0, 0.0], 'wait': [0, 0.0]})
+                _total[s['type']][0] += 1
+                _total[s['type']][1] += s['duration']
+            print(f'\ntime per {field}:')
+            print(f'  {field:<24} {"calls":>6} {"call s":>9} {"steps":>6} {"step s":>9} {"waits":>6} {"wait s":>9}')
+            for key, t in sorted(totals.items(), key=lambda i: -(i[1]['call'][1] + i[1]['step'][1] + i[1]['wait'][1])):
+                print(f'  {key:<24} {t["call"][0]:>6} {t["call"][1]:>9.2f} {t["step"][0]:>6} {t["step"][1]:>9.2f} {t["wait"][0]:>6} {t["wait"][1]:>9.2f}')
+
+    def close(self):
+        ''' write the chrome trace file '''
+        if not self.enabled:
+            return
+        threads = {}
+        events = []
+        for s in self.spans:
+            tid = threads.setdefault(s['thread'], len(threads) + 1)
+            events.append({
+                'name': s['name'], 'cat': s['phase'], 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                'ts': round((s['start'] - self.started) * 1000000), 'dur': round(s['duration'] * 1000000),
+                'args': dict(s['args'], kind=s['kind'], resource=s['resource'], type=s['type'])
+            })
+        for name, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}})
+        with open(f'{self.prefix}.json', 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        self._lines.close()
+        print(f'\ntrace written to {self.prefix}.json and {self.prefix}.jsonl')
+
+
+class TracingExecutor(Executor.Executor):
+    '''
+    records every command the wrapped executor runs as a call span
+    '''
+    def __init__(self, executor: Executor.Executor, tracer: Tracer):
+        self.executor = executor
+        self.tracer = tracer
+
+    @classmethod
+    def label(cls, command: list):
+        if command[:2] == ['az', 'rest']:
+            return f'rest {command[command.index("--method") + 1] if "--method" in command else "get"}'
+        verbs = []
+        for arg in command[1:]:
+            if arg.startswith('-'):
+                break
+            verbs.append(arg)
+        return ' '.join(verbs)
+
+    def run(self, command: list, timeout: int = None):
+        with self.tracer.span(self.label(command), 'call', command=' '.join(command)[:1000]) as args:
+            result = self.executor.run(command, timeout)
+            args['status'] = result.returncode
+            args['bytes'] = len(result.stdout or '') + len(result.stderr or '')
+        return result
+
+    def close(self):
+        self.executor.close()
+
+
+_tracer = Tracer()
+
+def set_tracer(tracer: Tracer):
+    global _tracer
+    _tracer = tracer
+
+def get():
+    return _tracer
+
+def span(name: str, type: str = 'step', phase: str = None, kind: str = None, resource: str = None, **args):
+    """
+    :return: context manager timing the block as a span of the current tracer
+    """
+    return _tracer.span(name, type, phase, kind, resource, **args)
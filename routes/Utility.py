@@ -1,24 +1,35 @@
 import json
-import sys
-import time
 import subprocess
-import collections
-
-def convert_from_unicode(data):
-  if isinstance(data, str):
-      return str(data)
-  elif isinstance(data, collections.abc.Mapping):
-      return dict(map(convert_from_unicode, data.items()))
-  elif isinstance(data, collections.abc.Iterable):
-      return type(data)(map(convert_from_unicode, data))
-  else:
-      return data
-
-def execute(runcmd=[], fatal=False, show=False):
+
+from routes import Executor
+
+_executor = Executor.AzCliExecutor()
+
+def set_executor(executor):
+    '''
+    select the backend every az call in this run goes through
+    '''
+    global _executor
+    _executor = executor
+
+def get_executor():
+    return _executor
+
+def run(runcmd=[], timeout=None):
+    """
+    :return: subprocess.CompletedProcess for the command, run by the selected executor
+    """
+    return _executor.run(runcmd, timeout)
+
+def execute(runcmd=[], fatal=False, show=False, parse=True):
+    """
+    :return: (True|False, output), the output json is only parsed when parse is True, writes that run with
+    -o none have nothing to parse
+    """
     if show:
       print(f'running command in execute(): {runcmd}')
 
-    _exec = subprocess.run(runcmd, universal_newlines=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    _exec = run(runcmd)
     result = _exec.stdout
     err = _exec.stderr
     if err and ('is in preview' not in err):
@@ -27,8 +38,8 @@ def execute(runcmd=[], fatal=False, show=False):
             raise RuntimeError(f'Failed: {runcmd}')
         else:
             return False, err 
-    if result:
-        output = convert_from_unicode(json.loads(result))
+    if result and parse:
+        output = json.loads(result)
         if len(output) >= 1 and show:
             print(output)
         return True, output
@@ -36,24 +47,58 @@ def execute(runcmd=[], fatal=False, show=False):
     return True, None
 
 
-def provisioning_needed(fdname: str, fdgroup: str, frontend: str, newssl_config: dict):
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {}
+
+
+def _normalize(value):
+    ''' sub resource references are compared by resource name, azure names are case insensitive '''
+    if isinstance(value, dict) and list(value) == ['id'] and isinstance(value['id'], str):
+        return value['id'].rstrip('/').split('/')[-1].lower()
+    return value
+
+
+def differs(desired, live):
+    """
+    :return: True|False if the desired value differs from the live value.
+    Only the keys present in a desired dictionary are compared, the live resource carries many read only fields
+    we do not manage. None, empty strings and empty collections are all treated as not set.
+    """
+    desired = _normalize(desired)
+    live = _normalize(live)
+    if _is_empty(desired) or _is_empty(live):
+        return not (_is_empty(desired) and _is_empty(live))
+    if isinstance(desired, dict):
+        if not isinstance(live, dict):
+            return True
+        return any(differs(v, live.get(k)) for k, v in desired.items())
+    if isinstance(desired, list):
+        if not isinstance(live, list) or len(desired) != len(live):
+            return True
+        return any(differs(d, l) for d, l in zip(desired, live))
+    if isinstance(desired, (int, float)) and not isinstance(desired, bool) and isinstance(live, str):
+        return str(desired) != live
+    return desired != live
+
+
+def changed_fields(desired: dict, live: dict):
+    """
+    :return: list of top level field names where the desired resource differs from the live resource
+    """
+    live = live or {}
+    return [k for k, v in desired.items() if differs(v, live.get(k))]
+
+
+def provisioning_needed(state, frontend: str, newssl_config: dict):
     print('lookup existing custom cert configuration....')
 
-    command = ['az']
-    command.extend(['network', 'front-door', 'frontend-endpoint', 'show',  '-g', fdgroup])
-    command.extend(['--name', frontend])
-    command.extend(['--front-door-name', fdname])
-
-    result = subprocess.run(command, capture_output=True, timeout=120, text=True)
-    ssl_config = {}
-
-    try:
-        ssl_config = json.loads(result.stdout)["customHttpsConfiguration"]
-        ssl_config = ssl_config if ssl_config else {}
-    except Exception as e:
-        print(f'failed to get current ssl config for {frontend}: {str(e)}')
+    front_end = state.frontend(frontend)
+    if not front_end:
+        print(f'failed to get current ssl config for {frontend}: not found in front door {state.fd_name}')
         return False
 
+    ssl_config = front_end.get('customHttpsConfiguration') or {}
+
     current_ssl_config = {
         "secret_name": ssl_config["secretName"] if 'secretName' in ssl_config else None,
         "secret_version": ssl_config["secretVersion"] if 'secretVersion' in ssl_config else None,
@@ -67,42 +112,5 @@ def provisioning_needed(fdname: str, fdgroup: str, frontend: str, newssl_config:
     return True
 
 
-def cert_provisioning_status(fdname: str, fdgroup: str, frontend: str, timeout: int, desired_status: str):
-    current_status = None
-    sys.stdout.flush()
-
-    print(f'timeout set to {(timeout / 60)} minutes')
-
-    command = ['az']
-    command.extend(['network', 'front-door', 'frontend-endpoint', 'wait',  '--timeout', str(timeout), '-g', fdgroup])
-    command.extend(['--name', frontend])
-    command.extend(['--front-door-name', fdname])
-    command.extend(['--custom', '"customHttpsProvisioningState!=\'Enabling\'"'])
-
-    _exec = subprocess.Popen(" ".join(command), shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-
-    result, err = _exec.communicate()
-
-    print('cert provisioning process has completed, getting status....')
-
-    command = ['az']
-    command.extend(['network', 'front-door', 'frontend-endpoint', 'show',  '-g', fdgroup])
-    command.extend(['--name', frontend])
-    command.extend(['--front-door-name', fdname])
-
-    try:
-        result = subprocess.run(command, capture_output=True, timeout=120, text=True)
-    except Exception as e:
-        print(f'failed to get frontend {frontend} config: {str(e)}')
-        return False, None
-
-    current_status = json.loads(result.stdout)["customHttpsProvisioningState"]
-
-    if current_status != desired_status:
-        return False, current_status
-    else:
-        return True, current_status
-
-
 def assert_command_succeeded(result: subprocess.CompletedProcess, error_msg: str):
     assert result.returncode == 0, f'{error_msg}\nstderr:\n{result.stderr}'
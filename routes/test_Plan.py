@@ -0,0 +1,122 @@
+import subprocess
+import threading
+import time
+import unittest
+
+from routes import Utility as util
+from routes import Executor
+from routes import Plan
+
+'''
+plan execution tests
+'''
+class FakeExecutor(Executor.Executor):
+    '''
+    This stands in for az. Every command takes delay seconds and succeeds, except the ones naming a resource in
+    fail. It records the commands it ran and how many front door writes ran at the same time.
+    '''
+    def __init__(self, delay: float = 0.05, fail: list = None):
+        self.delay = delay
+        self.fail = fail or []
+        self.commands = []
+        self.running = 0
+        self.running_front_door = 0
+        self.peak = 0
+        self.peak_front_door = 0
+        self._lock = threading.Lock()
+
+    def run(self, command: list, timeout: int = None):
+        front_door = 'front-door' in command and not 'rules-engine' in command
+        with self._lock:
+            self.commands.append(command)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            if front_door:
+                self.running_front_door += 1
+                self.peak_front_door = max(self.peak_front_door, self.running_front_door)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+            if front_door:
+                self.running_front_door -= 1
+        if any(name in command for name in self.fail):
+            return subprocess.CompletedProcess(command, 1, '', 'ERROR: (Conflict) the front door is busy')
+        return subprocess.CompletedProcess(command, 0, '', '')
+
+    def ran(self, name: str):
+        return any(name in command for command in self.commands)
+
+
+class PlanExecuteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = util.get_executor()
+
+    def tearDown(self):
+        util.set_executor(self.previous)
+
+    def execute(self, plan: Plan.Plan, executor: FakeExecutor, parallelism: int = 8):
+        util.set_executor(executor)
+        return plan.execute(parallelism=parallelism)
+
+    @classmethod
+    def write(cls, kind: str, name: str, after: list = None):
+        _kind = kind.replace(' ', '-')
+        return Plan.Operation('create', kind, name, ['az', 'network', 'front-door', _kind, 'create', '--name', name], after=after)
+
+    @classmethod
+    def engine(cls, name: str, after: list = None):
+        return Plan.Operation('update', 'rules engine', name, ['az', 'network', 'front-door', 'rules-engine', 'rule', 'update', '--name', name],
+                              after=after)
+
+    def test_front_door_writes_run_one_at_a_time(self):
+        plan = Plan.Plan(None)
+        for i in range(4):
+            plan.add(self.write('probe', f'probe{i}'))
+            plan.add(self.write('load balancing', f'lb{i}'))
+        for i in range(4):
+            plan.add(self.engine(f'engine{i}'))
+        executor = FakeExecutor()
+
+        self.assertEqual(self.execute(plan, executor), 0)
+        self.assertEqual(len(executor.commands), 12)
+        self.assertEqual(executor.peak_front_door, 1)
+        # rules engines are their own resources and still run next to the front door writes
+        self.assertGreater(executor.peak, 1)
+
+    def test_dependency_chain(self):
+        plan = Plan.Plan(None)
+        probe = plan.add(self.write('probe', 'probe0'))
+        pool = plan.add(self.write('pool', 'pool0', after=[probe]))
+        plan.add(self.write('routing rule', 'route0', after=[pool]))
+        executor = FakeExecutor(delay=0.01)
+
+        self.assertEqual(self.execute(plan, executor), 0)
+        self.assertEqual([c[c.index('--name') + 1] for c in executor.commands], ['probe0', 'pool0', 'route0'])
+
+    def test_failure_mid_plan_stops_and_raises(self):
+        plan = Plan.Plan(None)
+        probe = plan.add(self.write('probe', 'probe0'))
+        pool = plan.add(self.write('pool', 'pool0', after=[probe]))
+        plan.add(self.write('routing rule', 'route0', after=[pool]))
+        plan.add(self.write('probe', 'probe1'))
+        executor = FakeExecutor(delay=0.01, fail=['pool0'])
+
+        with self.assertRaisesRegex(RuntimeError, 'failed to create pool pool0'):
+            self.execute(plan, executor, parallelism=1)
+        self.assertTrue(executor.ran('pool0'))
+        self.assertFalse(executor.ran('route0'))
+        self.assertFalse(executor.ran('probe1'))
+
+    def test_non_fatal_failure_continues(self):
+        plan = Plan.Plan(None)
+        plan.add(Plan.Operation('create', 'dns cname', 'www', ['az', 'network', 'dns', 'record-set', 'cname', 'set-record', 'www'], fatal=False))
+        plan.add(self.write('probe', 'probe0'))
+        executor = FakeExecutor(delay=0.01, fail=['www'])
+
+        self.assertEqual(self.execute(plan, executor), 0)
+        self.assertTrue(executor.ran('probe0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
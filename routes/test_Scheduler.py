@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from routes import Plan
+from routes import Scheduler
+
+'''
+dependency graph scheduler tests
+'''
+def operation(name: str, after: list = None):
+    return Plan.Operation('create', 'probe', name, ['az', 'network', 'front-door', 'probe', 'create', '--name', name], after=after)
+
+
+class Recorder(object):
+    '''
+    This is the work callable handed to the scheduler. It records when each operation starts and finishes and
+    raises for the operations named in fail. delays overrides the time single operations take.
+    '''
+    def __init__(self, delay: float = 0.02, fail: list = None, delays: dict = None):
+        self.delay = delay
+        self.fail = fail or []
+        self.delays = delays or {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, op):
+        with self._lock:
+            self.events.append(('start', op.name))
+        time.sleep(self.delays.get(op.name, self.delay))
+        with self._lock:
+            self.events.append(('finish', op.name))
+        if op.name in self.fail:
+            raise RuntimeError(f'failed to create probe {op.name}')
+
+    def started(self):
+        return [name for event, name in self.events if event == 'start']
+
+    def index(self, event: str, name: str):
+        return self.events.index((event, name))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_dependency_chain_runs_in_order(self):
+        first = operation('first')
+        second = operation('second', after=[first])
+        third = operation('third', after=[second])
+        work = Recorder()
+        Scheduler.Scheduler([third, second, first], parallelism=4).run(work)
+
+        self.assertEqual(work.started(), ['first', 'second', 'third'])
+        self.assertLess(work.index('finish', 'first'), work.index('start', 'second'))
+        self.assertLess(work.index('finish', 'second'), work.index('start', 'third'))
+
+    def test_independent_operations_overlap(self):
+        ops = [operation(f'probe{i}') for i in range(4)]
+        work = Recorder(delay=0.1)
+        started = time.perf_counter()
+        Scheduler.Scheduler(ops, parallelism=4).run(work)
+
+        self.assertEqual(sorted(work.started()), [op.name for op in ops])
+        self.assertLess(time.perf_counter() - started, 0.3)
+
+    def test_cycle_raises(self):
+        a = operation('a')
+        b = operation('b', after=[a])
+        a.after.append(b)
+        free = operation('free')
+        work = Recorder()
+
+        with self.assertRaisesRegex(RuntimeError, 'dependency cycle'):
+            Scheduler.Scheduler([a, b, free], parallelism=2).run(work)
+        self.assertEqual(work.started(), ['free'])
+
+    def test_failure_starts_nothing_new_and_raises(self):
+        failing = operation('failing')
+        running = operation('running')
+        dependent = operation('dependent', after=[failing])
+        queued = [operation(f'queued{i}') for i in range(3)]
+        # the failing operation finishes first, the one running next to it is left to finish
+        work = Recorder(fail=['failing'], delays={'failing': 0.01, 'running': 0.2})
+
+        with self.assertRaisesRegex(RuntimeError, 'failed to create probe failing'):
+            Scheduler.Scheduler([failing, running, dependent] + queued, parallelism=2).run(work)
+
+        self.assertEqual(sorted(work.started()), ['failing', 'running'])
+        self.assertIn(('finish', 'running'), work.events)
+
+    def test_parallelism_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            Scheduler.Scheduler([operation('a')], parallelism=0)
+
+
+if __name__ == '__main__':
+    unittest.main()